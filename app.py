@@ -1,7 +1,16 @@
 import streamlit as st
-from functions.data_app_calculations import ClaimData, ICDGroupData, SpecialtyGroupData, ICDData
+import streamlit.components.v1 as components
+from functions.data_app_calculations import (ClaimData, ICDGroupData, SpecialtyGroupData, ICDData, ICDStatsIndex,
+                                             ClaimCube, BudgetScenarios, ParetoAnalysis)
+from functions.data_load import GroupTableQuery, get_period_kpis, get_racing_top
+from functions.data_access import open_database_reader
+from functions.data_cache import shared_cache
+from functions.data_metrics import timed, cache_miss
+from functions.data_migrations import apply_migrations
+from functions.data_snapshot import load_snapshot
 from functions import graphs_app as graphs
 import functions.data_settings as ds
+import functions.data_metrics as metrics
 
 st.set_page_config(
     page_title="Tynan Member Dashboard",
@@ -27,74 +36,270 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# st.fragment (st.experimental_fragment before 1.37) reruns only the decorated section when a
+# widget inside it changes.  Streamlit versions without it rerun the whole script, and the
+# sections still only build their payloads while their toggle is on.
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+
+# Timings of this script run are read back by the performance panel at the end of the page
+metrics.configure_log(ds.METRICS_LOG_PATH)
+run_start = metrics.get_sequence()
+
+
 # DATA LOADER
 #######################################################################################
 
-conn = st.connection('test_database', type='sql')
+database_path = ds.DATABASE_PATH
 
 
-@st.cache_data
-def fetch_claim_data():
-    db_query = "Select * from claim_data"
-    result = conn.query(db_query)
+@st.cache_resource
+def migrate_database():
+    result = apply_migrations(database_path)
 
     return result
 
 
-@st.cache_data
-def fetch_annual_member_count():
-    db_query = "Select Count(DISTINCT mem_acct_id) from group_table"
-    result = conn.query(db_query)
+@timed('fetch_snapshot', cached=True)
+@st.cache_resource(max_entries=1)
+@cache_miss
+def fetch_snapshot(data_version):
+    result = load_snapshot(database_path, ds.SNAPSHOT_DIR)
 
     return result
 
 
+@st.cache_resource
+def get_database_reader():
+    result = open_database_reader(ds.DB_BACKEND)
+
+    return result
+
+
+# DuckDB and Postgres copies (python -m functions.data_access) are made from a migrated file
+if ds.DB_BACKEND == 'sqlite':
+    migrate_database()
+conn = get_database_reader()
+
+# Every cached fetch takes data_version, so a change to the database invalidates both the
+# per-process Streamlit caches and the shared cache tier.
+data_version = conn.get_data_version()
+
+if ds.SNAPSHOT_DIR and ds.DB_BACKEND == 'sqlite':
+    snapshot = fetch_snapshot(data_version)
+    group_query = GroupTableQuery(dataframe=snapshot['group_table'])
+else:
+    group_query = GroupTableQuery(conn)
+
+
+@timed('fetch_period_kpis', cached=True)
 @st.cache_data
-def fetch_period_member_count():
-    db_query = "Select * from period_member_count"
-    result = conn.query(db_query)
-    result = result.set_index('period')
+@cache_miss
+def fetch_period_kpis(data_version):
+    result = get_period_kpis(conn)
+
+    return result
+
+
+def get_period_list(data_version):
+    # The periods in claim_data unless PERIOD_LIST is set, so a period appended with
+    # functions.data_ingest shows up without a settings change
+    if ds.PERIOD_LIST:
+        return list(ds.PERIOD_LIST)
+    result = [int(period) for period in fetch_period_kpis(data_version).index]
 
     return result
 
 
+def get_current_period(data_version):
+    if ds.CURRENT_PERIOD:
+        return ds.CURRENT_PERIOD
+    result = get_period_list(data_version)[-1]
+
+    return result
+
+
+period_list = get_period_list(data_version)
+current_period = get_current_period(data_version)
+
+
+@timed('fetch_period_comparison_html', cached=True)
 @st.cache_data
-def fetch_icd_racing():
-    db_query = "Select * from icd_racing"
-    result = conn.query(db_query)
+@cache_miss
+def fetch_period_comparison_html(data_version):
+    result = graphs.make_period_comparison_html(fetch_period_kpis(data_version), get_current_period(data_version))
+
+    return result
+
+
+@timed('fetch_period_indicators', cached=True)
+@st.cache_resource(max_entries=1)
+@cache_miss
+def fetch_period_indicators(data_version):
+    result = graphs.make_period_indicators(fetch_period_kpis(data_version), get_current_period(data_version))
+
+    return result
+
+
+@timed('fetch_icd_racing_json', cached=True)
+@shared_cache('icd_racing_chart')
+@cache_miss
+def fetch_icd_racing_json(data_version):
+    result = get_racing_top(conn, 'icd_racing')
     table_title = 'Injury_Disease'
     figure = graphs.make_icd_racing_chart(result, table_title)
 
-    return figure
+    return graphs.get_figure_json(graphs.compact_figure(figure))
 
 
-@st.cache_data
-def fetch_specialty_racing():
-    db_query = "Select * from specialty_racing"
-    result = conn.query(db_query)
+@timed('fetch_specialty_racing_json', cached=True)
+@shared_cache('specialty_racing_chart')
+@cache_miss
+def fetch_specialty_racing_json(data_version):
+    result = get_racing_top(conn, 'specialty_racing')
     table_title = 'Provider Specialty'
     figure = graphs.make_icd_racing_chart(result, table_title)
 
+    return graphs.get_figure_json(graphs.compact_figure(figure))
+
+
+# The animated figures are shared through the cache tier as JSON and rebuilt once per process
+@timed('fetch_icd_racing', cached=True)
+@st.cache_resource(max_entries=1)
+@cache_miss
+def fetch_icd_racing(data_version):
+    figure = graphs.load_figure_json(fetch_icd_racing_json(data_version))
+
     return figure
 
 
+@timed('fetch_specialty_racing', cached=True)
+@st.cache_resource(max_entries=1)
+@cache_miss
+def fetch_specialty_racing(data_version):
+    figure = graphs.load_figure_json(fetch_specialty_racing_json(data_version))
+
+    return figure
+
+
+@timed('fetch_icd_table', cached=True)
+@st.cache_data
+@shared_cache('icd_table')
+@cache_miss
+def fetch_icd_table(data_version):
+    query_group = ICDGroupData(group_query)
+    result = query_group.build_icd_table()
+
+    return result
+
+
+@timed('fetch_specialty_table', cached=True)
+@st.cache_data
+@shared_cache('specialty_table')
+@cache_miss
+def fetch_specialty_table(data_version):
+    query_group = SpecialtyGroupData(group_query)
+    result = query_group.build_specialty_table()
+
+    return result
+
+
+@timed('fetch_icd_options', cached=True)
 @st.cache_data
-def fetch_group_table():
-    db_query = "Select * from group_table"
-    result = conn.query(db_query)
+@cache_miss
+def fetch_icd_options(data_version):
+    result = group_query.get_icd_options()
 
     return result
 
 
+@timed('fetch_specialty_options', cached=True)
 @st.cache_data
-def fetch_heatmap_data():
-    heatmap_data = fetch_group_table()
-    heatmap_data = heatmap_data[heatmap_data['specialty_id'] != 209]
-    figure = graphs.make_icd_spec_heatmap(heatmap_data)
+@cache_miss
+def fetch_specialty_options(data_version):
+    result = group_query.get_specialty_options()
+
+    return result
+
+
+@timed('fetch_icd_stats_index', cached=True)
+@st.cache_resource
+@shared_cache('icd_stats_index')
+@cache_miss
+def fetch_icd_stats_index(data_version):
+    result = ICDStatsIndex(group_query)
+
+    return result
+
+
+# The selection panel's index for one set of sidebar filters, built from the cube's cells
+@timed('fetch_filtered_icd_stats_index', cached=True)
+@st.cache_resource(max_entries=16)
+@cache_miss
+def fetch_filtered_icd_stats_index(data_version, periods, icd_names, specialty_names):
+    result = ICDStatsIndex(fetch_claim_cube(data_version).select(periods, list(icd_names), list(specialty_names)))
+
+    return result
+
+
+@timed('fetch_claim_cube', cached=True)
+@st.cache_resource
+@shared_cache('claim_cube')
+@cache_miss
+def fetch_claim_cube(data_version):
+    result = ClaimCube(group_query)
+
+    return result
+
+
+# Each dimension's ranking is computed on first use and kept in the shared object
+@timed('fetch_pareto_analysis', cached=True)
+@st.cache_resource
+@cache_miss
+def fetch_pareto_analysis(data_version):
+    result = ParetoAnalysis(group_query)
+
+    return result
+
+
+@timed('fetch_budget_scenarios', cached=True)
+@st.cache_resource
+@cache_miss
+def fetch_budget_scenarios(data_version):
+    result = BudgetScenarios(fetch_period_kpis(data_version), ds.SCENARIO_AVG_PER_DAY, ds.SCENARIO_OVERHEAD_RATES,
+                             ds.SCENARIO_ADMIN_RATES, ds.SCENARIO_PROFIT_RATES)
+
+    return result
+
+
+@timed('fetch_heatmap_matrix', cached=True)
+@st.cache_data
+@shared_cache('heatmap_matrix')
+@cache_miss
+def fetch_heatmap_matrix(data_version):
+    result = group_query.get_icd_spec_matrix(exclude_specialty_ids=ds.HEATMAP_EXCLUDED_SPECIALTY_IDS,
+                                             n=ds.HEATMAP_TOP_N)
+
+    return result
+
+
+@timed('fetch_heatmap_chart', cached=True)
+@st.cache_data
+@cache_miss
+def fetch_heatmap_chart(data_version):
+    figure = graphs.compact_figure(graphs.make_icd_spec_heatmap(fetch_heatmap_matrix(data_version)))
 
     return figure
 
 
+def show_plotly_chart(figure, name=None, **kwargs):
+    # st.plotly_chart serializes the figure, so this timing is the figure's serialization cost;
+    # the record's bytes are the figure's JSON as sent to the browser
+    with metrics.timer(f'st.plotly_chart {name}' if name else 'st.plotly_chart') as record:
+        st.plotly_chart(figure, **kwargs)
+        record['result'] = figure
+
+
 # LAYOUT SECTION
 #######################################################################################
 
@@ -124,8 +329,8 @@ st.markdown("")
 col = st.columns((2, 2, 2, 2, 2))
 
 with col[0]:
-    annual_stats = fetch_claim_data()
-    annual_data = ClaimData(annual_stats, ds.CURRENT_PERIOD)
+    annual_stats = fetch_period_kpis(data_version)
+    annual_data = ClaimData(annual_stats, current_period)
 
     st.markdown("Metric:")
     st.markdown("YTD:")
@@ -147,10 +352,8 @@ with col[3]:
     st.markdown("")
 
 with col[4]:
-    a_members = fetch_annual_member_count()
-
     st.markdown("Members")
-    st.markdown(f'{a_members.iloc[0, 0]:,}')
+    st.markdown(f'{annual_data.a_members:,}')
     st.markdown("")
 
 st.markdown("")
@@ -159,91 +362,153 @@ st.markdown("")
 # ROW
 #######################################################################################
 
-col = st.columns(8)
+@fragment
+def show_period_comparison():
+    col = st.columns(8)
 
-with col[0]:
-    select_period = st.selectbox("Select Period:", ds.PERIOD_LIST)
+    with col[0]:
+        select_period = st.selectbox("Select Period:", period_list)
+        indicators = fetch_period_indicators(data_version)[select_period]
 
-# ROW
-#######################################################################################
+    col = st.columns((2, 2, 2, 2, 2))
 
-col = st.columns((2, 2, 2, 2, 2))
+    with col[0]:
+        st.markdown("Current Period:")
+        st.markdown(f'Select Period: {select_period}')
+        st.markdown("Difference")
 
-with col[0]:
-    st.markdown("Current Period:")
-    st.markdown(f'Select Period: {select_period}')
-    st.markdown("Difference")
+    with col[1]:
+        p_claims = annual_data.get_select_claims(select_period)
+        fig = indicators['claims']
 
-with col[1]:
-    p_claims = annual_data.get_select_claims(select_period)
-    fig = graphs.claims_indicator(annual_data.c_claims, p_claims)
+        st.markdown(f'{annual_data.c_claims:,}')
+        st.markdown(f'{p_claims:,}')
+        show_plotly_chart(fig, 'claims_indicator', use_container_width=False)
 
-    st.markdown(f'{annual_data.c_claims:,}')
-    st.markdown(f'{p_claims:,}')
-    st.plotly_chart(fig, use_container_width=False)
+    with col[2]:
+        p_paid = annual_data.get_select_paid(select_period)
+        fig = indicators['paid']
 
-with col[2]:
-    p_paid = annual_data.get_select_paid(select_period)
-    fig = graphs.paid_indicator(annual_data.c_paid, p_paid)
+        st.markdown(f'$ {annual_data.c_paid:,.0f}')
+        st.markdown(f'$ {p_paid:,.0f}')
+        show_plotly_chart(fig, 'paid_indicator', use_container_width=False)
 
-    st.markdown(f'$ {annual_data.c_paid:,.0f}')
-    st.markdown(f'$ {p_paid:,.0f}')
-    st.plotly_chart(fig, use_container_width=False)
+    with col[3]:
+        p_average = p_paid / p_claims
+        fig = indicators['average']
 
-with col[3]:
-    p_average = p_paid / p_claims
-    fig = graphs.average_indicator(annual_data.c_ave_per_claim, p_average)
+        st.markdown(f'$ {annual_data.c_ave_per_claim:,.2f}')
+        st.markdown(f'$ {p_average:,.2f}')
+        show_plotly_chart(fig, 'average_indicator', use_container_width=False)
+
+    with col[4]:
+        c_member = annual_data.c_members
+        p_member = annual_data.get_select_members(select_period)
+        fig = indicators['members']
 
-    st.markdown(f'$ {annual_data.c_ave_per_claim:,.2f}')
-    st.markdown(f'$ {p_average:,.2f}')
-    st.plotly_chart(fig, use_container_width=False)
+        st.markdown(f'{c_member}')
+        st.markdown(f'{p_member}')
+        show_plotly_chart(fig, 'member_indicator', use_container_width=False)
 
-with col[4]:
-    a_members = fetch_annual_member_count()
-    member_stats = fetch_period_member_count()
-    c_member = member_stats.loc[ds.CURRENT_PERIOD, 'daily_member_sum']
-    p_member = member_stats.loc[select_period, 'daily_member_sum']
-    fig = graphs.member_indicator(c_member, p_member)
 
-    st.markdown(f'{c_member}')
-    st.markdown(f'{p_member}')
-    st.plotly_chart(fig, use_container_width=False)
+if ds.PERIOD_COMPARISON == 'browser':
+    # All periods are embedded in the page, so changing the period never reaches the server
+    components.html(fetch_period_comparison_html(data_version), height=190)
+else:
+    show_period_comparison()
 
 st.markdown("---")
 st.markdown("")
 st.markdown("<h3 style='text-align: center'>Insurance Claim Charts & Tables</h3>", unsafe_allow_html=True)
 st.markdown("")
 
+# FILTERS
+#######################################################################################
+
+# The sections below follow these filters, except the racing charts, which are labelled.
+# Filtered results come from the pre-aggregated cube, which is only built once a filter is set.
+with st.sidebar:
+    st.subheader("Filters")
+    filter_periods = st.select_slider("Periods", options=period_list, value=(period_list[0], period_list[-1]),
+                                      key='filter_periods')
+    filter_icd_names = st.multiselect("Injury or Disease", fetch_icd_options(data_version), key='filter_icd_names')
+    filter_specialty_names = st.multiselect("Provider Specialty", fetch_specialty_options(data_version),
+                                            key='filter_specialty_names')
+
+is_filtered = (filter_periods != (period_list[0], period_list[-1]) or bool(filter_icd_names)
+               or bool(filter_specialty_names))
+cube_selection = None
+if is_filtered:
+    cube_selection = fetch_claim_cube(data_version).select(filter_periods, filter_icd_names, filter_specialty_names)
+
+if is_filtered:
+    filter_totals = cube_selection.get_totals()
+
+    col = st.columns((2, 2, 2, 2, 2))
+
+    with col[0]:
+        st.markdown("Filtered:")
+        st.markdown(f'Periods {filter_periods[0]} - {filter_periods[1]}')
+
+    with col[1]:
+        st.markdown("Claims Processed")
+        st.markdown(f'{filter_totals["claims"]:,}')
+
+    with col[2]:
+        st.markdown("Claim Charges")
+        st.markdown(f'$ {filter_totals["charges"]:,.0f}')
+
+    with col[3]:
+        st.markdown("Average Charges")
+        st.markdown(f'$ {filter_totals["average"]:,.2f}')
+
+    with col[4]:
+        st.markdown("Members (approx.)")
+        st.markdown(f'{filter_totals["members"]:,}')
+
+    st.markdown("")
+
 # ROW
 #######################################################################################
 
 ###  RACING CHARTS
 
-with st.expander("TOP 10 CLAIMS PROCESSED"):
+@fragment
+def show_racing_charts():
+    if not st.toggle("TOP 10 CLAIMS PROCESSED", key='show_racing_charts'):
+        return
+
+    if is_filtered:
+        st.markdown("All claims, year to date: the sidebar filters do not apply to these charts")
 
     col = st.columns((4, 0.5, 4))
 
     with col[0]:
-        icd_racing_chart = fetch_icd_racing()
-        st.plotly_chart(icd_racing_chart, use_container_width=True)
+        icd_racing_chart = fetch_icd_racing(data_version)
+        show_plotly_chart(icd_racing_chart, 'icd_racing', use_container_width=True)
 
     with col[2]:
-        specialty_racing_chart = fetch_specialty_racing()
-        st.plotly_chart(specialty_racing_chart, use_container_width=True)
+        specialty_racing_chart = fetch_specialty_racing(data_version)
+        show_plotly_chart(specialty_racing_chart, 'specialty_racing', use_container_width=True)
 
+
+show_racing_charts()
 st.markdown("")
 
 ### ICD Table
 
-with st.expander("INJURY/DISEASE TABLE (Sort Columns)"):
+@fragment
+def show_icd_table():
+    if not st.toggle("INJURY/DISEASE TABLE (Sort Columns)", key='show_icd_table'):
+        return
+
     col = st.columns([2, 7, 1])
 
     with col[1]:
-        main_query = fetch_group_table()
-
-        query_group = ICDGroupData(main_query)
-
-        query_final = query_group.build_icd_table()
+        if is_filtered:
+            query_final = ICDGroupData(cube_selection).build_icd_table()
+        else:
+            query_final = fetch_icd_table(data_version)
 
         st.dataframe(query_final,
                      column_config={
@@ -258,6 +523,8 @@ with st.expander("INJURY/DISEASE TABLE (Sort Columns)"):
                      },
                      hide_index=True)
 
+
+show_icd_table()
 st.markdown("")
 
 # ROW
@@ -265,13 +532,18 @@ st.markdown("")
 
 ### SPECIALTY Table
 
-with st.expander("PROVIDER SPECIALTY TABLE (Sort Columns)"):
+@fragment
+def show_specialty_table():
+    if not st.toggle("PROVIDER SPECIALTY TABLE (Sort Columns)", key='show_specialty_table'):
+        return
+
     col = st.columns([2, 7, 1])
-    query_group = SpecialtyGroupData(main_query)
 
     with col[1]:
-
-        query_final = query_group.build_specialty_table()
+        if is_filtered:
+            query_final = SpecialtyGroupData(cube_selection).build_specialty_table()
+        else:
+            query_final = fetch_specialty_table(data_version)
 
         st.dataframe(query_final,
                      column_config={
@@ -285,26 +557,87 @@ with st.expander("PROVIDER SPECIALTY TABLE (Sort Columns)"):
                      },
                      hide_index=True)
 
+
+show_specialty_table()
 st.markdown("")
 
 # ROW
 #######################################################################################
 
-with st.expander("HEATMAP"):
+@fragment
+def show_heatmap():
+    if not st.toggle("HEATMAP", key='show_heatmap'):
+        return
+
     col = st.columns([1, 7, 1])
 
     with col[1]:
-        heatmap_chart = fetch_heatmap_data()
-        st.plotly_chart(heatmap_chart, use_container_width=True)
+        if not is_filtered:
+            heatmap_chart = fetch_heatmap_chart(data_version)
+        else:
+            heatmap_matrix = cube_selection.get_icd_spec_matrix(exclude_specialty_ids=ds.HEATMAP_EXCLUDED_SPECIALTY_IDS,
+                                                               n=ds.HEATMAP_TOP_N)
+            if heatmap_matrix.empty:
+                st.markdown("No claims match the filters")
+                return
+            heatmap_chart = graphs.compact_figure(graphs.make_icd_spec_heatmap(heatmap_matrix))
+
+        show_plotly_chart(heatmap_chart, 'icd_spec_heatmap', use_container_width=True)
+
 
+show_heatmap()
 st.markdown("")
 
 # ROW
 #######################################################################################
 
-with st.expander("INJURY/DISEASE SELECTION"):
+@fragment
+def show_provider_breakdown():
+    if not st.toggle("PROVIDER BREAKDOWN", key='show_provider_breakdown'):
+        return
+
+    pareto = ParetoAnalysis(cube_selection) if is_filtered else fetch_pareto_analysis(data_version)
+
+    col = st.columns(4)
 
-    icd_options = main_query['icd_name'].drop_duplicates().sort_values()
+    with col[0]:
+        cutoff = st.slider("Share of Charges", min_value=0.5, max_value=0.95, value=ds.PARETO_CUTOFF, step=0.05)
+
+    col = st.columns((4, 0.5, 4))
+
+    for index, (column, label, title) in enumerate([('icd_name', "Injuries or Diseases", 'Top Injury or Diseases'),
+                                                    ('specialty_name', "Specialties", 'Top Specialty')]):
+        contributors = pareto.get_contributors(column, cutoff)
+        name_count = len(pareto.get_ranking(column))
+        share = contributors['cum_share'].iloc[-1] if len(contributors) else 0
+
+        with col[index * 2]:
+            st.markdown(f'{len(contributors)} of {name_count} {label} make up {share:.0%} of charges')
+            fig = graphs.make_pareto_pie(contributors, column, 'charges', title)
+            show_plotly_chart(fig, f'{column}_pareto', use_container_width=True)
+
+
+show_provider_breakdown()
+st.markdown("")
+
+# ROW
+#######################################################################################
+
+@fragment
+def show_icd_selection():
+    if not st.toggle("INJURY/DISEASE SELECTION", key='show_icd_selection'):
+        return
+
+    if is_filtered:
+        icd_stats_index = fetch_filtered_icd_stats_index(data_version, filter_periods, tuple(filter_icd_names),
+                                                         tuple(filter_specialty_names))
+        icd_options = sorted(icd_stats_index.stats)
+        if not icd_options:
+            st.markdown("No claims match the filters")
+            return
+    else:
+        icd_stats_index = fetch_icd_stats_index(data_version)
+        icd_options = fetch_icd_options(data_version)
 
     col = st.columns(5)
 
@@ -312,7 +645,7 @@ with st.expander("INJURY/DISEASE SELECTION"):
         choice = st.selectbox('Select an Injury or Disease', icd_options)
         st.markdown("")
 
-        icd_stats = ICDData(main_query, choice)
+        icd_stats = ICDData(icd_stats_index, choice)
 
     col = st.columns((2, 2, 2, 2, 2))
 
@@ -333,7 +666,8 @@ with st.expander("INJURY/DISEASE SELECTION"):
         st.markdown(f'$ {icd_stats.average:,.2f}')
 
     with col[4]:
-        st.markdown("Members")
+        # Filtered member counts are sketch estimates, as in the filtered KPI row
+        st.markdown("Members (approx.)" if is_filtered else "Members")
         st.markdown(f'{icd_stats.get_member_count()}')
 
     st.markdown("")
@@ -343,9 +677,95 @@ with st.expander("INJURY/DISEASE SELECTION"):
     with col[0]:
         icd_choices = icd_stats.get_period_claim_count()
         fig = graphs.make_icd_period_bar_chart(icd_choices, choice)
-        st.plotly_chart(fig, use_container_width=True)
+        show_plotly_chart(fig, 'icd_period_bar', use_container_width=True)
 
     with col[2]:
         choice_from_icd_choice = icd_stats.get_specialty_claims()
         fig = graphs.make_icd_specialty_bar_chart(choice_from_icd_choice, choice)
-        st.plotly_chart(fig, use_container_width=True)
+        show_plotly_chart(fig, 'icd_specialty_bar', use_container_width=True)
+
+
+show_icd_selection()
+st.markdown("")
+
+# ROW
+#######################################################################################
+
+@fragment
+def show_budget_scenarios():
+    if not st.toggle("BUDGET & P&L SCENARIOS", key='show_budget_scenarios'):
+        return
+
+    # Every combination of the sliders' values is computed once; moving a slider only looks one up
+    scenarios = fetch_budget_scenarios(data_version)
+
+    col = st.columns(4)
+
+    with col[0]:
+        avg_per_day = st.slider("Daily Budget", min_value=ds.SCENARIO_AVG_PER_DAY[0],
+                                max_value=ds.SCENARIO_AVG_PER_DAY[-1], value=ds.AVG_PER_DAY,
+                                step=ds.SCENARIO_AVG_PER_DAY[1] - ds.SCENARIO_AVG_PER_DAY[0], format='$%d')
+
+    with col[1]:
+        overhead_rate = st.slider("Overhead Rate", min_value=ds.SCENARIO_OVERHEAD_RATES[0],
+                                  max_value=ds.SCENARIO_OVERHEAD_RATES[-1], value=ds.OVERHEAD_RATE, step=0.01)
+
+    with col[2]:
+        admin_rate = st.slider("Admin Rate", min_value=ds.SCENARIO_ADMIN_RATES[0],
+                               max_value=ds.SCENARIO_ADMIN_RATES[-1], value=ds.ADMIN_RATE, step=0.01)
+
+    with col[3]:
+        profit_rate = st.slider("Profit Rate", min_value=ds.SCENARIO_PROFIT_RATES[0],
+                                max_value=ds.SCENARIO_PROFIT_RATES[-1], value=ds.PROFIT_RATE, step=0.01)
+
+    # The sliders' steps are the grid's, so the nearest scenario is the one selected
+    scenario = scenarios.get_scenario(avg_per_day, overhead_rate, admin_rate, profit_rate)
+
+    col = st.columns((4, 0.5, 3))
+
+    with col[0]:
+        fig = graphs.make_bar_chart_period(scenarios.get_period_budget_table(scenario))
+        show_plotly_chart(fig, 'budget_bar', use_container_width=True)
+
+    with col[2]:
+        fig = graphs.make_profit_impact_bar(scenarios.get_charge_impact_table(scenario))
+        show_plotly_chart(fig, 'profit_impact_bar', use_container_width=True)
+
+    col = st.columns([1, 7, 1])
+
+    with col[1]:
+        fig = graphs.make_sensitivity_heatmap(scenarios.get_sensitivity_table('avg_per_day', 'overhead_rate', scenario))
+        show_plotly_chart(fig, 'sensitivity_heatmap', use_container_width=True)
+
+
+show_budget_scenarios()
+
+
+# PERFORMANCE PANEL
+#######################################################################################
+
+if ds.METRICS_ENABLED:
+    with st.sidebar:
+        if st.toggle("Performance", key='show_metrics'):
+            run_records = metrics.get_records(run_start)
+            fetch_seconds = sum(record['seconds'] for record in run_records if record['name'].startswith('fetch_'))
+            st.markdown(f"This run: {fetch_seconds:,.3f} s in fetches")
+            st.dataframe([{'name': record['name'],
+                           'ms': round(record['seconds'] * 1000, 1),
+                           'cache': record['cache'],
+                           'rows': record['rows'],
+                           'bytes': record['payload_bytes']} for record in run_records],
+                         hide_index=True)
+
+            st.markdown("Since the process started:")
+            st.dataframe([{'name': name,
+                           'calls': totals['calls'],
+                           'hits': totals['hits'],
+                           'misses': totals['misses'],
+                           'mean ms': round(totals['seconds'] / totals['calls'] * 1000, 1),
+                           'max ms': round(totals['max_seconds'] * 1000, 1)} for name, totals in
+                          sorted(metrics.get_summary().items())],
+                         hide_index=True)
+
+    if ds.METRICS_PROMETHEUS_PATH:
+        metrics.write_prometheus(ds.METRICS_PROMETHEUS_PATH)
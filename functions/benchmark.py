@@ -0,0 +1,281 @@
+import argparse
+import gc
+import itertools
+import json
+import pickle
+import platform
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import functions.data_settings as ds
+import functions.graphs_app as graphs
+from functions.data_app_calculations import ICDGroupData, SpecialtyGroupData, ICDData, ICDStatsIndex, BudgetScenarios
+from functions.data_load import GroupTableQuery, freeze_frame
+from functions.data_synthetic import make_synthetic_claims
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+BENCHMARKS = ['build_icd_table', 'build_specialty_table', 'icd_stats_index', 'icd_data', 'icd_spec_matrix',
+              'icd_racing_chart', 'period_indicators', 'budget_scenarios']
+
+
+def make_racing_table(claims, column='icd_name'):
+    # Year to date claim counts per name and period, like icd_racing/specialty_racing
+    counts = claims.groupby([column, 'period'], observed=True).size().unstack(fill_value=0)
+    result = counts.cumsum(axis=1).stack().rename('claim_count_ytd').reset_index()
+    result = result.rename(columns={column: 'name'})
+    result['name'] = result['name'].astype(str)
+
+    return result
+
+
+def make_kpi_table(claims):
+    # The period-indexed KPI frame of data_load.get_period_kpis
+    result = claims.groupby('period').agg(claims_period_count=('charge_allowed', 'count'),
+                                          claims_period_paid=('charge_allowed', 'sum'),
+                                          daily_member_sum=('mem_acct_id', 'nunique'))
+
+    return result
+
+
+def get_benchmark_functions(claims):
+    top_icd = claims['icd_name'].value_counts().index[0]
+    # Built once per process in the app; icd_data is what each choice of the selection panel costs
+    icd_stats = ICDStatsIndex(claims)
+    racing = make_racing_table(claims)
+    kpis = make_kpi_table(claims)
+
+    result = {
+        'build_icd_table': lambda: ICDGroupData(claims).build_icd_table(),
+        'build_specialty_table': lambda: SpecialtyGroupData(claims).build_specialty_table(),
+        'icd_stats_index': lambda: ICDStatsIndex(claims),
+        'icd_data': lambda: ICDData(icd_stats, top_icd).get_specialty_claims(),
+        'icd_spec_matrix': lambda: GroupTableQuery(dataframe=claims).get_icd_spec_matrix(
+            exclude_specialty_ids=ds.HEATMAP_EXCLUDED_SPECIALTY_IDS),
+        'icd_racing_chart': lambda: graphs.make_icd_racing_chart(racing, 'Benchmark'),
+        'period_indicators': lambda: graphs.make_period_indicators(kpis, kpis.index[-1]),
+        'budget_scenarios': lambda: BudgetScenarios(kpis, ds.SCENARIO_AVG_PER_DAY, ds.SCENARIO_OVERHEAD_RATES,
+                                                    ds.SCENARIO_ADMIN_RATES, ds.SCENARIO_PROFIT_RATES),
+    }
+
+    return result
+
+
+def time_function(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def measure_peak_memory(func):
+    # A separate run, since tracing allocations slows the timed runs down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def measure_session_memory(claims, sessions, shared):
+    # Bytes still held after each of the sessions has read the claims frame and built the ICD
+    # table.  Without sharing every session holds its own unpickled copy, which is what
+    # st.cache_data hands each caller; shared, they all read one frozen frame from st.cache_resource.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        frame = freeze_frame(claims) if shared else None
+        held = []
+        for _ in range(sessions):
+            session_frame = frame if shared else pickle.loads(pickle.dumps(claims))
+            held.append((session_frame, ICDGroupData(session_frame).build_icd_table()))
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {'held_bytes': current, 'peak_bytes': peak}
+
+    return result
+
+
+def run_session_memory(sizes, sessions, seed=0):
+    result = []
+    for n_claims in sizes:
+        claims = make_synthetic_claims(n_claims, seed=seed)
+        result.append({'claims': n_claims,
+                       'sessions': sessions,
+                       'frame_bytes': int(claims.memory_usage(index=False, deep=True).sum()),
+                       'copies': measure_session_memory(claims, sessions, shared=False),
+                       'shared': measure_session_memory(claims, sessions, shared=True)
+                       })
+
+    return result
+
+
+def run_payload_report(sizes, seed=0):
+    # JSON bytes sent to the browser for the cached charts, as built and after compact_figure
+    result = []
+    for n_claims in sizes:
+        claims = make_synthetic_claims(n_claims, seed=seed)
+        figures = {'icd_racing_chart': graphs.make_icd_racing_chart(make_racing_table(claims), 'Benchmark'),
+                   'specialty_racing_chart': graphs.make_icd_racing_chart(make_racing_table(claims, 'specialty_name'),
+                                                                          'Benchmark'),
+                   'icd_spec_heatmap': graphs.make_icd_spec_heatmap(GroupTableQuery(dataframe=claims)
+                                                                    .get_icd_spec_matrix())}
+        report = graphs.payload_report(figures)
+        report.insert(0, 'claims', n_claims)
+        result.extend(report.to_dict('records'))
+
+    return result
+
+
+def run_case(n_claims, icd_count, specialty_count, periods, benchmarks=None, repeat=3, seed=0):
+    benchmarks = BENCHMARKS if benchmarks is None else benchmarks
+    start = time.perf_counter()
+    claims = make_synthetic_claims(n_claims, icd_count, specialty_count, periods, seed=seed)
+    functions = get_benchmark_functions(claims)
+    case = {'claims': n_claims,
+            'icd_count': icd_count,
+            'specialty_count': specialty_count,
+            'periods': periods,
+            'frame_bytes': int(claims.memory_usage(index=False, deep=True).sum()),
+            'setup_seconds': round(time.perf_counter() - start, 4),
+            'results': {}
+            }
+
+    for name in benchmarks:
+        timings = time_function(functions[name], repeat)
+        case['results'][name] = {'min_seconds': round(min(timings), 6),
+                                 'median_seconds': round(statistics.median(timings), 6),
+                                 'peak_bytes': measure_peak_memory(functions[name])
+                                 }
+
+    return case
+
+
+def run_benchmarks(sizes=None, icd_counts=(400,), specialty_counts=(60,), period_counts=(12,), benchmarks=None,
+                   repeat=3, seed=0, progress=None):
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    result = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'plotly': plotly.__version__,
+              'machine': platform.machine(),
+              'repeat': repeat,
+              'cases': []
+              }
+
+    for n_claims, icd_count, specialty_count, periods in itertools.product(sizes, icd_counts, specialty_counts,
+                                                                           period_counts):
+        case = run_case(n_claims, icd_count, specialty_count, periods, benchmarks, repeat, seed)
+        result['cases'].append(case)
+        if progress:
+            progress(case)
+
+    return result
+
+
+def get_case_key(case):
+    return case['claims'], case['icd_count'], case['specialty_count'], case['periods']
+
+
+def compare_results(baseline, current, threshold=0.1):
+    # Benchmarks whose best time grew by more than threshold (a fraction) against the baseline
+    baseline_cases = {get_case_key(case): case for case in baseline['cases']}
+    regressions = []
+
+    for case in current['cases']:
+        baseline_case = baseline_cases.get(get_case_key(case))
+        if baseline_case is None:
+            continue
+        for name, timing in case['results'].items():
+            if name not in baseline_case['results']:
+                continue
+            before = baseline_case['results'][name]['min_seconds']
+            after = timing['min_seconds']
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append({'case': get_case_key(case), 'benchmark': name, 'before': before,
+                                    'after': after, 'change': round((after - before) / before, 3)})
+
+    return regressions
+
+
+def format_session_memory(entry):
+    result = (f"{entry['claims']:,} claims, {entry['sessions']} sessions "
+              f"({entry['frame_bytes'] / 2 ** 20:,.1f} MiB frame): "
+              f"copies hold {entry['copies']['held_bytes'] / 2 ** 20:,.1f} MiB, "
+              f"shared holds {entry['shared']['held_bytes'] / 2 ** 20:,.1f} MiB")
+
+    return result
+
+
+def format_payload(entry):
+    result = (f"{entry['claims']:,} claims {entry['chart']:<24} {entry['bytes_before']:>10,} bytes -> "
+              f"{entry['bytes_after']:>10,} bytes ({entry['reduction']:.0%} smaller)")
+
+    return result
+
+
+def format_case(case):
+    lines = [f"{case['claims']:,} claims, {case['icd_count']} ICDs, {case['specialty_count']} specialties, "
+             f"{case['periods']} periods ({case['frame_bytes'] / 2 ** 20:,.1f} MiB frame)"]
+    for name, timing in case['results'].items():
+        lines.append(f"    {name:<22} {timing['min_seconds'] * 1000:>10,.1f} ms "
+                     f"{timing['peak_bytes'] / 2 ** 20:>10,.1f} MiB peak")
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the dashboard's table and chart builders on synthetic claims.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Claim counts, e.g. 10000 50000000")
+    parser.add_argument('--icds', type=int, nargs='+', default=[400], help="ICD cardinalities")
+    parser.add_argument('--specialties', type=int, nargs='+', default=[60], help="Specialty cardinalities")
+    parser.add_argument('--periods', type=int, nargs='+', default=[12], help="Period counts")
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--sessions', type=int, default=None,
+                        help="Also compare memory held by this many sessions with copied and shared frames")
+    parser.add_argument('--payloads', action='store_true', help="Also report chart JSON bytes before and after "
+                                                                 "compaction")
+    parser.add_argument('--compare', default=None, help="Earlier results file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Allowed slowdown before reporting (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.icds, args.specialties, args.periods, args.benchmarks, args.repeat,
+                             args.seed, progress=lambda case: print(format_case(case), flush=True))
+    if args.sessions:
+        results['session_memory'] = run_session_memory(args.sizes, args.sessions, args.seed)
+        for entry in results['session_memory']:
+            print(format_session_memory(entry))
+    if args.payloads:
+        results['payloads'] = run_payload_report(args.sizes, args.seed)
+        for entry in results['payloads']:
+            print(format_payload(entry))
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            found = compare_results(json.load(baseline_file), results, args.threshold)
+        for regression in found:
+            print(f"Regression {regression['case']} {regression['benchmark']}: "
+                  f"{regression['before']:.4f}s -> {regression['after']:.4f}s ({regression['change']:+.0%})")
+        if found:
+            raise SystemExit(1)
@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+import functions.data_settings as ds
+from functions.data_cache import get_data_version
+from functions.data_metrics import timed
+from functions.data_migrations import MIGRATIONS, apply_migrations
+
+COPY_TABLES = ['group_table', 'claim_data', 'period_member_count', 'icd_racing', 'specialty_racing',
+               'group_period_summary', 'member_count_summary']
+PARAMETER_PATTERN = re.compile(r'(?<![:\w]):([A-Za-z_]\w*)')
+
+
+def adapt_query(db_query, dialect):
+    # The dashboard's queries use sqlite-style :name parameters; DuckDB binds $name and
+    # psycopg2 %(name)s (where a literal % must be doubled).
+    if dialect == 'duckdb':
+        return PARAMETER_PATTERN.sub(r'$\1', db_query)
+    if dialect == 'postgres':
+        return PARAMETER_PATTERN.sub(r'%(\1)s', db_query.replace('%', '%%'))
+
+    return db_query
+
+
+def connect_read_only(db_path, mmap_size=None, cache_size_kib=None):
+    # mode=ro plus query_only, so nothing run through the dashboard can write.  sqlite3 keeps
+    # a per-connection cache of prepared statements, which the pooled connections reuse.
+    mmap_size = ds.DB_MMAP_SIZE if mmap_size is None else mmap_size
+    cache_size_kib = ds.DB_CACHE_SIZE_KIB if cache_size_kib is None else cache_size_kib
+
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30, check_same_thread=False,
+                              cached_statements=256)
+    db_conn.execute("PRAGMA query_only = ON")
+    db_conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    db_conn.execute(f"PRAGMA cache_size = {-int(cache_size_kib)}")
+    db_conn.execute("PRAGMA temp_store = MEMORY")
+
+    return db_conn
+
+
+class SQLiteReader:
+    # A pool of read-only connections shared by every session of the process.  Connections are
+    # opened on demand up to pool_size; a query waits for a free one after that.  Has the same
+    # query(db_query, params) signature as st.connection, so it can be passed wherever a
+    # connection is expected (GroupTableQuery, get_racing_top, get_period_kpis).
+    def __init__(self, db_path, pool_size=None, mmap_size=None, cache_size_kib=None):
+        self.db_path = db_path
+        self.pool_size = ds.DB_POOL_SIZE if pool_size is None else pool_size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        db_conn = self.acquire()
+        try:
+            yield db_conn
+        finally:
+            self.idle.put(db_conn)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if self.opened < self.pool_size:
+                self.opened += 1
+                try:
+                    return connect_read_only(self.db_path, self.mmap_size, self.cache_size_kib)
+                except Exception:
+                    self.opened -= 1
+                    raise
+
+        return self.idle.get(timeout=60)
+
+    @timed('SQLiteReader.query')
+    def query(self, db_query, params=None):
+        with self.connection() as db_conn:
+            result = pd.read_sql_query(db_query, db_conn, params=params)
+
+        return result
+
+    def query_chunks(self, db_query, params=None, chunk_size=100_000):
+        # The result chunk_size rows at a time; the pooled connection is held until the last chunk
+        with self.connection() as db_conn:
+            cursor = db_conn.execute(db_query, params or {})
+            try:
+                columns = [column[0] for column in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self.lock:
+            while True:
+                try:
+                    self.idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self.opened -= 1
+
+    def get_data_version(self):
+        result = get_data_version(self.db_path)
+
+        return result
+
+
+class DuckDBReader:
+    # A read-only DuckDB file.  Each query runs on its own cursor, so sessions can query it
+    # from several threads at once.  Needs the optional duckdb package.
+    def __init__(self, db_path):
+        import duckdb
+
+        self.db_path = db_path
+        self.db = duckdb.connect(db_path, read_only=True)
+
+    @timed('DuckDBReader.query')
+    def query(self, db_query, params=None):
+        cursor = self.db.cursor()
+        try:
+            result = cursor.execute(adapt_query(db_query, 'duckdb'), params or {}).df()
+        finally:
+            cursor.close()
+
+        return result
+
+    def query_chunks(self, db_query, params=None, chunk_size=100_000):
+        # DuckDB hands results over in vectors of 2048 rows
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(adapt_query(db_query, 'duckdb'), params or {})
+            while True:
+                chunk = cursor.fetch_df_chunk(max(1, chunk_size // 2048))
+                if chunk.empty:
+                    break
+                yield chunk
+        finally:
+            cursor.close()
+
+    def get_data_version(self):
+        stat = os.stat(self.db_path)
+        result = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+
+        return result
+
+    def close(self):
+        self.db.close()
+
+
+class PostgresReader:
+    # A pool of read-only PostgreSQL sessions.  Needs the optional psycopg2 package.
+    def __init__(self, url, pool_size=None):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.url = url
+        self.pool = ThreadedConnectionPool(1, ds.DB_POOL_SIZE if pool_size is None else pool_size, url)
+
+    @contextlib.contextmanager
+    def connection(self):
+        db_conn = self.pool.getconn()
+        try:
+            db_conn.set_session(readonly=True, autocommit=True)
+            yield db_conn
+        finally:
+            self.pool.putconn(db_conn)
+
+    @timed('PostgresReader.query')
+    def query(self, db_query, params=None):
+        with self.connection() as db_conn:
+            with db_conn.cursor() as cursor:
+                cursor.execute(adapt_query(db_query, 'postgres'), params or {})
+                columns = [column[0] for column in cursor.description]
+                result = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+
+        return result
+
+    def query_chunks(self, db_query, params=None, chunk_size=100_000):
+        # A server-side cursor, so the rows leave the server chunk_size at a time.  withhold keeps
+        # it open outside a transaction, as the sessions run in autocommit mode.
+        with self.connection() as db_conn:
+            with db_conn.cursor(name='dashboard_chunks', withhold=True) as cursor:
+                cursor.execute(adapt_query(db_query, 'postgres'), params or {})
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    columns = [column[0] for column in cursor.description]
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def get_data_version(self):
+        # There is no file to look at; claim_data and member_count_summary change with every
+        # ingested period, so their contents identify the data.
+        kpis = self.query("Select c.*, m.members_ytd from claim_data c "
+                          "left join member_count_summary m on m.period = c.period order by c.period")
+        result = hashlib.sha1(kpis.to_csv(index=False).encode()).hexdigest()[:16]
+
+        return result
+
+    def close(self):
+        self.pool.closeall()
+
+
+def open_database_reader(backend=None, target=None):
+    # target is a file path for sqlite and duckdb and a connection URL for postgres
+    backend = ds.DB_BACKEND if backend is None else backend
+    if backend == 'sqlite':
+        return SQLiteReader(target or ds.DATABASE_PATH)
+    if backend == 'duckdb':
+        return DuckDBReader(target or ds.DATABASE_PATH)
+    if backend == 'postgres':
+        return PostgresReader(target or ds.DATABASE_URL)
+
+    raise ValueError(f"Unknown database backend: {backend!r}")
+
+
+def copy_database(sqlite_path, backend, target, chunk_size=1_000_000):
+    # Copies the migrated dashboard tables from sqlite into a new DuckDB file or a PostgreSQL
+    # database, so the same dashboard can be pointed at either.
+    apply_migrations(sqlite_path)
+    source = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+
+    try:
+        if backend == 'duckdb':
+            import duckdb
+
+            db = duckdb.connect(target)
+            for table_name in COPY_TABLES:
+                db.execute(f"DROP TABLE IF EXISTS {table_name}")
+                for i, chunk in enumerate(pd.read_sql_query(f"Select * from {table_name}", source,
+                                                            chunksize=chunk_size)):
+                    if i == 0:
+                        db.execute(f"CREATE TABLE {table_name} AS SELECT * FROM chunk")
+                    else:
+                        db.execute(f"INSERT INTO {table_name} SELECT * FROM chunk")
+            db.close()
+        elif backend == 'postgres':
+            from sqlalchemy import create_engine
+
+            engine = create_engine(target)
+            with engine.begin() as db_conn:
+                for table_name in COPY_TABLES:
+                    replace = 'replace'
+                    for chunk in pd.read_sql_query(f"Select * from {table_name}", source, chunksize=chunk_size):
+                        chunk.to_sql(table_name, db_conn, if_exists=replace, index=False, chunksize=10_000)
+                        replace = 'append'
+                # The first migration's indexes are plain CREATE INDEX statements Postgres accepts
+                for statement in MIGRATIONS[0][1]:
+                    db_conn.exec_driver_sql(statement)
+                db_conn.exec_driver_sql("ANALYZE")
+            engine.dispose()
+        else:
+            raise ValueError(f"Can only copy to duckdb or postgres, not {backend!r}")
+    finally:
+        source.close()
+
+    return target
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy the dashboard tables from sqlite to DuckDB or PostgreSQL.")
+    parser.add_argument('sqlite_path')
+    parser.add_argument('--backend', choices=['duckdb', 'postgres'], required=True)
+    parser.add_argument('--target', required=True, help="DuckDB file path or PostgreSQL URL")
+    args = parser.parse_args()
+
+    copy_database(args.sqlite_path, args.backend, args.target)
+    print(f"{args.sqlite_path} copied to {args.backend}: {args.target}")
@@ -1,165 +1,515 @@
 import functions.data_settings as ds
 import numpy as np
+import pandas as pd
+from functions.data_load import ID_COLUMNS, as_group_query, check_group_column, pivot_top_counts, rank_pareto
+from functions.data_metrics import timed
+
+
+SCENARIO_PARAMETERS = ['avg_per_day', 'overhead_rate', 'admin_rate', 'profit_rate']
+CELL_KEYS = ['period', 'injury_disease_id', 'specialty_id']
+
+
+def get_wrap_rate(overhead_rate, admin_rate, profit_rate):
+    # data_settings.WRAP_RATE for any rates, scalars or arrays
+    result = np.round((1 + overhead_rate) * (1 + admin_rate) * (1 + profit_rate) - 1, 2)
+
+    return result
+
+
+def get_budget_day_counts(periods):
+    # Days budgeted for each period: period n takes data_settings.BUDGET_DAY_COUNTS[n - 1], and
+    # periods past the end of that list start over from its first entry (period 13 is budgeted
+    # like period 1)
+    periods = np.asarray(periods)
+    if len(periods) and (not np.issubdtype(periods.dtype, np.integer) or periods.min() < 1):
+        raise ValueError(f"Budget periods must be whole numbers from 1, got {periods.tolist()}")
+    day_counts = np.asarray(ds.BUDGET_DAY_COUNTS, dtype='float64')
+    result = day_counts[(periods - 1) % len(day_counts)]
+
+    return result
+
+
+class BudgetScenarios:
+    # Every combination of daily budget and overhead/admin/profit rates evaluated at once.  The
+    # parameters form a scenario axis that broadcasts against the period axis, so each result is
+    # a scenario x period matrix; the input table is never modified.  dataframe has
+    # claims_period_paid per period (data_load.get_period_kpis); without a day_count column the
+    # periods are budgeted with get_budget_day_counts.
+    @timed()
+    def __init__(self, dataframe, avg_per_day=None, overhead_rates=None, admin_rates=None, profit_rates=None):
+        self.table = dataframe.set_index('period') if 'period' in dataframe.columns else dataframe
+        values = [ds.AVG_PER_DAY if avg_per_day is None else avg_per_day,
+                  ds.OVERHEAD_RATE if overhead_rates is None else overhead_rates,
+                  ds.ADMIN_RATE if admin_rates is None else admin_rates,
+                  ds.PROFIT_RATE if profit_rates is None else profit_rates]
+        grid = np.meshgrid(*[np.atleast_1d(np.asarray(value, dtype='float64')) for value in values], indexing='ij')
+        self.scenarios = pd.DataFrame({name: axis.ravel() for name, axis in zip(SCENARIO_PARAMETERS, grid)})
+        self.scenarios['wrap_rate'] = get_wrap_rate(self.scenarios['overhead_rate'], self.scenarios['admin_rate'],
+                                                    self.scenarios['profit_rate'])
+
+        if 'day_count' in self.table.columns:
+            day_count = self.table['day_count'].to_numpy(dtype='float64')
+        else:
+            day_count = get_budget_day_counts(self.table.index.to_numpy())
+        paid = self.table['claims_period_paid'].to_numpy(dtype='float64')
+
+        budget = self.scenarios['avg_per_day'].to_numpy()[:, None] * day_count[None, :]
+        self.charge_budget = np.round(budget)
+        self.charge_variance = np.round(self.charge_budget - paid)
+        self.cum_charge_variance = np.cumsum(self.charge_variance, axis=1)
+        self.charges_variance = paid - budget
+        self.pl_impact = np.round(self.charges_variance * self.scenarios['wrap_rate'].to_numpy()[:, None])
+
+        self.scenarios['P&L Impact'] = self.pl_impact.sum(axis=1)
+        self.scenarios['Cumulative Variance'] = self.cum_charge_variance[:, -1]
+
+    def get_scenario(self, avg_per_day=None, overhead_rate=None, admin_rate=None, profit_rate=None):
+        # Position of the scenario nearest to the given values; a missing value means the
+        # data_settings constant
+        values = [ds.AVG_PER_DAY if avg_per_day is None else avg_per_day,
+                  ds.OVERHEAD_RATE if overhead_rate is None else overhead_rate,
+                  ds.ADMIN_RATE if admin_rate is None else admin_rate,
+                  ds.PROFIT_RATE if profit_rate is None else profit_rate]
+        parameters = self.scenarios[SCENARIO_PARAMETERS].to_numpy()
+        distance = np.abs((parameters - values) / np.where(values, values, 1)).sum(axis=1)
+        result = int(np.argmin(distance))
+
+        return result
+
+    def get_period_budget_table(self, scenario=0):
+        # What CorporateTables.make_period_budget_table adds, for one scenario
+        result = self.table.copy()
+        result['charge_budget'] = self.charge_budget[scenario]
+        result['charge_variance'] = self.charge_variance[scenario]
+        result['cum_charge_variance'] = self.cum_charge_variance[scenario]
+
+        return result
+
+    def get_charge_impact_table(self, scenario=0):
+        # What CorporateTables.make_charge_impact_table returns, for one scenario
+        result = self.table.drop(columns=[column for column in ['day_count', 'claims_period_paid']
+                                          if column in self.table.columns])
+        result['Charges Variance'] = self.charges_variance[scenario]
+        result['P&L Impact'] = self.pl_impact[scenario]
+        result['Color'] = np.where(self.pl_impact[scenario] < 0, '#DE2C62', '#0083B8')
+        result.index.names = ['Period']
+
+        return result
+
+    def get_sensitivity_table(self, row, column, scenario=0):
+        # Total P&L impact over two parameters, the others held at the given scenario's values
+        others = [name for name in SCENARIO_PARAMETERS if name not in (row, column)]
+        selected = self.scenarios
+        for name in others:
+            selected = selected[selected[name] == self.scenarios.loc[scenario, name]]
+        result = selected.pivot_table(index=row, columns=column, values='P&L Impact', aggfunc='sum')
+
+        return result
 
 
 class CorporateTables:
+    # The data_settings scenario of BudgetScenarios; the input frame is left unchanged
     def __init__(self, dataframe):
         self.table = dataframe
+        self.scenarios = BudgetScenarios(dataframe)
 
+    @timed()
     def make_charge_impact_table(self):
-        self.table['budget_charges'] = self.table['day_count'] * ds.AVG_PER_DAY
-        self.table['Charges Variance'] = self.table['claims_period_paid'] - self.table['budget_charges']
-        self.table['P&L Impact'] = round(self.table['Charges Variance'] * ds.WRAP_RATE, 0)
-        self.table['Color'] = np.where(self.table['P&L Impact'] < 0, '#DE2C62', '#0083B8')
-        self.table.set_index('period', inplace=True)
-        self.table.index.names = ['Period']
-        self.table.drop(['day_count', 'claims_period_paid', 'budget_charges'], axis=1, inplace=True)
+        result = self.scenarios.get_charge_impact_table()
 
-        return self.table
+        return result
 
+    @timed()
     def make_period_budget_table(self):
-        self.table['charge_budget'] = round(self.table['day_count'] * ds.AVG_PER_DAY, 0)
-        self.table['charge_variance'] = round(self.table['charge_budget'] - self.table['claims_period_paid'])
-        self.table['cum_charge_variance'] = self.table['charge_variance'].cumsum()
+        result = self.scenarios.get_period_budget_table()
 
-        return self.table
+        return result
 
 
 class ClaimData:
+    # dataframe is indexed by period (data_load.get_period_kpis), so rows are looked up by
+    # period rather than by position
     def __init__(self, dataframe, current_period):
         self.table = dataframe
-        self.a_claims = dataframe.loc[current_period - 1, 'claims_period_count_cum']
-        self.a_paid = dataframe.loc[current_period - 1, 'claims_period_paid_cum']
+        self.a_claims = dataframe.loc[current_period, 'claims_period_count_cum']
+        self.a_paid = dataframe.loc[current_period, 'claims_period_paid_cum']
         self.a_ave_per_claim = self.a_paid / self.a_claims
-        self.c_claims = dataframe.loc[current_period - 1, 'claims_period_count']
-        self.c_paid = dataframe.loc[current_period - 1, 'claims_period_paid']
+        self.a_members = dataframe.loc[current_period, 'members_ytd']
+        self.c_claims = dataframe.loc[current_period, 'claims_period_count']
+        self.c_paid = dataframe.loc[current_period, 'claims_period_paid']
         self.c_ave_per_claim = self.c_paid / self.c_claims
+        self.c_members = dataframe.loc[current_period, 'daily_member_sum']
 
     def get_select_claims(self, period):
-        p_claims = self.table.loc[period - 1, 'claims_period_count']
+        p_claims = self.table.loc[period, 'claims_period_count']
 
         return p_claims
 
     def get_select_paid(self, period):
-        p_paid = self.table.loc[period - 1, 'claims_period_paid']
+        p_paid = self.table.loc[period, 'claims_period_paid']
 
         return p_paid
 
+    def get_select_members(self, period):
+        p_members = self.table.loc[period, 'daily_member_sum']
 
-class ICDGroupData:
-    def __init__(self, dataframe):
-        self.icd_table = None
+        return p_members
+
+
+class DimensionGroupData:
+    @timed()
+    def __init__(self, dataframe, column):
+        self.column = column
+        self.chart_column = column.replace('_name', '_chart_data')
         self.row_list = None
-        self.table = dataframe
-        self.group_table = self.table.groupby('icd_name', as_index=False).agg(Claims=('charge_allowed', 'count'),
-                                                                              Charges=('charge_allowed', 'sum'),
-                                                                              Average=('charge_allowed', 'mean'),
-                                                                              Max=('charge_allowed', 'max')
-                                                                              )
-        self.group_pivot = self.table.pivot_table(index='icd_name',
-                                                  columns='period',
-                                                  values='charge_allowed',
-                                                  aggfunc='count',
-                                                  fill_value=0
-                                                  )
-        self.joined_table_pivot = self.group_table.merge(self.group_pivot, how='left', left_on=['icd_name'],
-                                                         right_index=True)
+        self.dimension_table = None
+        self.query = as_group_query(dataframe)
+        self.group_table = self.query.get_group_summary(self.column)
+        self.group_pivot = self.query.get_group_pivot(self.column)
 
     def create_group_claims_list(self):
-        self.row_list = []
-
-        for i in self.group_pivot.index:
-            row = self.group_pivot.loc[i, :].to_list()
-            self.row_list.append(row)
+        # One pass over the pivot's array, aligned to the summary rows, instead of a .loc per row
+        period_counts = self.group_pivot.reindex(self.group_table[self.column], fill_value=0)
+        self.row_list = period_counts.to_numpy().tolist()
 
         return self.row_list
 
     def join_claims_list_joined_table(self):
-        self.joined_table_pivot['icd_chart_data'] = self.create_group_claims_list()
+        joined_table = self.group_table.copy()
+        joined_table[self.chart_column] = self.create_group_claims_list()
+
+        return joined_table
+
+    @timed()
+    def build_table(self):
+        self.dimension_table = self.join_claims_list_joined_table()
+        self.dimension_table = self.dimension_table.loc[:, [self.column, 'Claims', 'Charges', 'Average', 'Max',
+                                                            self.chart_column]]
+
+        return self.dimension_table
+
 
-        return self.joined_table_pivot
+class ICDGroupData(DimensionGroupData):
+    def __init__(self, dataframe):
+        super().__init__(dataframe, 'icd_name')
+        self.icd_table = None
 
     def build_icd_table(self):
-        self.icd_table = self.join_claims_list_joined_table()
-        self.icd_table = self.icd_table.loc[:, ['icd_name', 'Claims', 'Charges', 'Average', 'Max', 'icd_chart_data']]
+        self.icd_table = self.build_table()
 
         return self.icd_table
 
 
-class SpecialtyGroupData:
+class SpecialtyGroupData(DimensionGroupData):
     def __init__(self, dataframe):
-        self.row_list = None
+        super().__init__(dataframe, 'specialty_name')
         self.specialty_table = None
-        self.table = dataframe
-
-        self.group_table = self.table.groupby('specialty_name', as_index=False).agg(Claims=('charge_allowed', 'count'),
-                                                                                    Charges=('charge_allowed', 'sum'),
-                                                                                    Average=('charge_allowed', 'mean'),
-                                                                                    Max=('charge_allowed', 'max')
-                                                                                    )
-        self.group_pivot = self.table.pivot_table(index='specialty_name',
-                                                  columns='period',
-                                                  values='charge_allowed',
-                                                  aggfunc='count',
-                                                  fill_value=0
-                                                  )
-        self.joined_table_pivot = self.group_table.merge(self.group_pivot, how='left', left_on=['specialty_name'],
-                                                         right_index=True)
 
-    def create_group_claims_list(self):
-        self.row_list = []
+    def build_specialty_table(self):
+        self.specialty_table = self.build_table()
 
-        for i in self.group_pivot.index:
-            row = self.group_pivot.loc[i, :].to_list()
-            self.row_list.append(row)
+        return self.specialty_table
 
-        return self.row_list
 
-    def join_claims_list_joined_table(self):
-        self.joined_table_pivot['specialty_chart_data'] = self.create_group_claims_list()
+class ParetoAnalysis:
+    # Names ranked by charges with their cumulative share, computed once per dimension (one
+    # window query when reading the database).  The contributing set for any cutoff is a slice
+    # of that ranking.
+    def __init__(self, dataframe):
+        self.query = as_group_query(dataframe)
+        self.rankings = {}
+
+    @timed()
+    def get_ranking(self, column):
+        if column not in self.rankings:
+            self.rankings[column] = self.query.get_pareto_ranking(column)
+
+        return self.rankings[column]
+
+    def get_contributors(self, column, cutoff=None, include_crossing=True):
+        # Names up to and including the one whose cumulative share reaches cutoff, so the set
+        # always makes up at least cutoff of the charges (and is never empty while there are any).
+        # include_crossing=False stops before that name, the rule of the hospital pie charts.
+        cutoff = ds.PARETO_CUTOFF if cutoff is None else cutoff
+        ranking = self.get_ranking(column)
+        cum_share = ranking['cum_share'].shift(fill_value=0) if include_crossing else ranking['cum_share']
+        result = ranking[cum_share < cutoff]
+
+        return result
+
+
+class ICDStatsIndex:
+    @timed()
+    def __init__(self, dataframe, top_specialties=10):
+        query = as_group_query(dataframe)
+        self.stats = {}
+
+        summary = query.get_group_summary('icd_name').set_index('icd_name')
+        members = query.get_group_member_counts('icd_name').set_index('icd_name')['members']
+
+        period_counts = (query.get_group_period_counts('icd_name')
+                         .rename(columns={'claims': 'charge_allowed'})
+                         .sort_values(by=['icd_name', 'period'])
+                         .loc[:, ['period', 'icd_name', 'charge_allowed']]
+                         )
+        period_counts = dict(tuple(period_counts.groupby('icd_name', observed=True)))
+
+        specialty_counts = (query.get_icd_spec_counts()
+                            .rename(columns={'claims': 'charge_allowed'})
+                            .sort_values(by=['icd_name', 'charge_allowed', 'specialty_name'],
+                                         ascending=[True, False, True])
+                            .groupby('icd_name', observed=True)
+                            .head(top_specialties)
+                            .loc[:, ['icd_name', 'specialty_name', 'charge_allowed']]
+                            )
+        specialty_counts = dict(tuple(specialty_counts.groupby('icd_name', observed=True)))
 
-        return self.joined_table_pivot
+        for row in summary.itertuples():
+            icd_name = row.Index
+            self.stats[icd_name] = {
+                'claims': row.Claims,
+                'charges': row.Charges,
+                'average': row.Average,
+                'members': members[icd_name],
+                'period_counts': period_counts[icd_name].reset_index(drop=True),
+                'specialty_claims': specialty_counts[icd_name].drop(columns='icd_name').reset_index(drop=True),
+            }
 
-    def build_specialty_table(self):
-        self.specialty_table = self.join_claims_list_joined_table()
-        self.specialty_table = self.specialty_table.loc[:,
-                               ['specialty_name', 'Claims', 'Charges', 'Average', 'Max', 'specialty_chart_data']]
+    def get_stats(self, choice):
+        icd_stats = self.stats[choice]
 
-        return self.specialty_table
+        return icd_stats
 
 
 class ICDData:
     def __init__(self, dataframe, choice):
-        self.table = dataframe
+        if not isinstance(dataframe, ICDStatsIndex):
+            dataframe = ICDStatsIndex(dataframe)
+        self.index = dataframe
         self.choice = choice
-        self.table_group = (self.table.groupby('icd_name', as_index=False)
-                            .agg(Claims=('charge_allowed', 'count'),
-                                 Charges=('charge_allowed', 'sum'),
-                                 Average=('charge_allowed', 'mean')
-                                 )
-                            )
-        self.table_group = self.table_group[self.table_group['icd_name'] == self.choice]
-        self.claims = self.table_group.iloc[0, 1]
-        self.charges = self.table_group.iloc[0, 2]
-        self.average = self.table_group.iloc[0, 3]
+        self.stats = self.index.get_stats(self.choice)
+        self.claims = self.stats['claims']
+        self.charges = self.stats['charges']
+        self.average = self.stats['average']
 
     def get_member_count(self):
-        member_table = self.table.loc[:, ['mem_acct_id', 'icd_name']]
-        member_count = member_table[member_table['icd_name'] == self.choice].iloc[:, 0].nunique()
+        member_count = self.stats['members']
 
         return member_count
 
     def get_period_claim_count(self):
-        period_table = self.table.groupby(['period', 'icd_name'], as_index=False)['charge_allowed'].count()
-        period_table = period_table[period_table['icd_name'] == self.choice]
+        period_table = self.stats['period_counts']
 
         return period_table
 
     def get_specialty_claims(self):
-        specialty_table = self.table[self.table['icd_name'] == self.choice]
-        specialty_table = (specialty_table.groupby('specialty_name', as_index=False)['charge_allowed']
-                           .count()
-                           .nlargest(10, 'charge_allowed')
-                           )
+        specialty_table = self.stats['specialty_claims']
 
         return specialty_table
+
+
+def hash_members(member_ids):
+    # splitmix64 finalizer: spreads sequential member ids over all 64 bits
+    with np.errstate(over='ignore'):
+        hashed = np.asarray(member_ids).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        hashed = (hashed ^ (hashed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        hashed = (hashed ^ (hashed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        result = hashed ^ (hashed >> np.uint64(31))
+
+    return result
+
+
+def get_sketch_registers(member_ids, precision):
+    # HyperLogLog: the top precision bits of a member's hash pick a register and the position
+    # of the first set bit in the rest is its rank.  frexp gives that bit length exactly.
+    hashed = hash_members(member_ids)
+    registers = (hashed >> np.uint64(64 - precision)).astype(np.int64)
+    remainder_bits = 64 - precision
+    remainder = hashed & np.uint64((1 << remainder_bits) - 1)
+    ranks = (remainder_bits + 1 - np.frexp(remainder.astype(np.float64))[1]).astype(np.uint8)
+
+    return registers, ranks
+
+
+def estimate_distinct(registers):
+    register_count = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / register_count)
+    estimate = alpha * register_count ** 2 / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    empty = int(np.count_nonzero(registers == 0))
+
+    # Linear counting is the better estimate while many registers are still empty
+    if estimate <= 2.5 * register_count and empty:
+        estimate = register_count * np.log(register_count / empty)
+
+    return int(round(estimate))
+
+
+class ClaimCube:
+    # Claims pre-aggregated to period x ICD x specialty cells (count, charge total, largest
+    # charge) plus a sparse HyperLogLog sketch of each cell's members.  Any combination of a
+    # period range, ICDs and specialties is answered from the cells without touching group_table.
+    # The claim rows are read in chunks and rolled up as they arrive, so memory follows the size
+    # of the cube rather than of group_table.
+    @timed()
+    def __init__(self, dataframe, precision=None, chunk_size=None):
+        self.precision = ds.CUBE_SKETCH_PRECISION if precision is None else precision
+        chunk_size = ds.CUBE_CHUNK_ROWS if chunk_size is None else chunk_size
+        query = as_group_query(dataframe)
+
+        # Each chunk's cells get a number the first time they are seen; the sketch is kept as
+        # (cell number << precision | register) keys with the highest rank of each
+        cell_numbers = {}
+        cells = []
+        sketch_keys = []
+        sketch_ranks = []
+        for chunk in query.get_cube_chunks(chunk_size):
+            # Aggregate in float64 even when charge_allowed is stored as float32 (the snapshot)
+            chunk = chunk.astype({'charge_allowed': 'float64'})
+            grouped = chunk.groupby(CELL_KEYS, observed=True)
+            chunk_cells = grouped.agg(claims=('charge_allowed', 'count'), charges=('charge_allowed', 'sum'),
+                                      max_charge=('charge_allowed', 'max'))
+            numbers = np.array([cell_numbers.setdefault(key, len(cell_numbers)) for key in chunk_cells.index])
+            cells.append(chunk_cells.assign(cell=numbers))
+
+            registers, ranks = get_sketch_registers(chunk['mem_acct_id'].to_numpy(), self.precision)
+            keys = (numbers[grouped.ngroup().to_numpy()] << self.precision) | registers
+            chunk_sketch = pd.Series(ranks).groupby(keys).max()
+            sketch_keys.append(chunk_sketch.index.to_numpy())
+            sketch_ranks.append(chunk_sketch.to_numpy())
+
+        cells = (pd.concat(cells).groupby('cell')
+                 .agg(claims=('claims', 'sum'), charges=('charges', 'sum'), max_charge=('max_charge', 'max'))
+                 )
+        cells = pd.concat([pd.DataFrame(list(cell_numbers), columns=CELL_KEYS), cells], axis=1)
+        for column in ['icd_name', 'specialty_name']:
+            id_names = query.get_id_names(column, cells[ID_COLUMNS[column]].unique())
+            cells = cells.merge(id_names, how='left', on=ID_COLUMNS[column])
+            cells[column] = cells[column].astype(str)
+        order = np.lexsort((cells['specialty_name'], cells['icd_name'], cells['period']))
+        self.cells = cells.iloc[order].reset_index(drop=True)
+        self.icd_names = sorted(self.cells['icd_name'].unique())
+        self.specialty_names = sorted(self.cells['specialty_name'].unique())
+        self.periods = self.cells['period'].to_numpy()
+        self.icd_codes = pd.Categorical(self.cells['icd_name'], categories=self.icd_names).codes
+        self.specialty_codes = pd.Categorical(self.cells['specialty_name'], categories=self.specialty_names).codes
+
+        # Only the highest rank per cell and register is kept, so a cell never holds more than
+        # 2 ** precision entries however many members it has
+        sketch = pd.Series(np.concatenate(sketch_ranks)).groupby(np.concatenate(sketch_keys)).max()
+        keys = sketch.index.to_numpy()
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        self.sketch_cells = positions[keys >> self.precision]
+        self.sketch_registers = keys & ((1 << self.precision) - 1)
+        self.sketch_ranks = sketch.to_numpy()
+
+    def get_cell_mask(self, periods=None, icd_names=None, specialty_names=None):
+        # periods is an inclusive (first, last) range; an empty or missing name list means all
+        mask = np.ones(len(self.cells), dtype=bool)
+        if periods is not None:
+            mask &= (self.periods >= periods[0]) & (self.periods <= periods[1])
+        if icd_names:
+            mask &= np.isin(self.icd_codes, pd.Categorical(icd_names, categories=self.icd_names).codes)
+        if specialty_names:
+            mask &= np.isin(self.specialty_codes,
+                            pd.Categorical(specialty_names, categories=self.specialty_names).codes)
+
+        return mask
+
+    def select(self, periods=None, icd_names=None, specialty_names=None):
+        result = ClaimCubeSelection(self, self.get_cell_mask(periods, icd_names, specialty_names))
+
+        return result
+
+    def get_member_count(self, mask):
+        registers = np.zeros(2 ** self.precision, dtype=np.uint8)
+        selected = mask[self.sketch_cells]
+        np.maximum.at(registers, self.sketch_registers[selected], self.sketch_ranks[selected])
+
+        return estimate_distinct(registers)
+
+    def get_group_member_counts(self, mask, column):
+        # Estimated members per name of column among the selected cells: one merged sketch per name
+        codes, names = {'icd_name': (self.icd_codes, self.icd_names),
+                        'specialty_name': (self.specialty_codes, self.specialty_names)}[column]
+        registers = np.zeros((len(names), 2 ** self.precision), dtype=np.uint8)
+        selected = mask[self.sketch_cells]
+        np.maximum.at(registers, (codes[self.sketch_cells[selected]], self.sketch_registers[selected]),
+                      self.sketch_ranks[selected])
+        present = np.unique(codes[mask])
+        result = pd.DataFrame({column: [names[code] for code in present],
+                               'members': [estimate_distinct(registers[code]) for code in present]})
+
+        return result
+
+
+class ClaimCubeSelection:
+    # The cells matching one set of filters.  Has the group methods of data_load.GroupTableQuery
+    # that the dimension tables, ICDStatsIndex and the heatmap use, so ICDGroupData(cube.select(...))
+    # builds a filtered table.  Member counts are sketch estimates.
+    def __init__(self, cube, mask):
+        self.cube = cube
+        self.mask = mask
+        self.cells = cube.cells[mask]
+
+    @timed()
+    def get_totals(self):
+        claims = int(self.cells['claims'].sum())
+        charges = float(self.cells['charges'].sum())
+        result = {'claims': claims,
+                  'charges': charges,
+                  'average': charges / claims if claims else 0.0,
+                  'max': float(self.cells['max_charge'].max()) if claims else 0.0,
+                  'members': self.cube.get_member_count(self.mask)
+                  }
+
+        return result
+
+    def get_group_summary(self, column):
+        check_group_column(column)
+
+        result = (self.cells.groupby(column, as_index=False)
+                  .agg(Claims=('claims', 'sum'), Charges=('charges', 'sum'), Max=('max_charge', 'max'))
+                  )
+        result.insert(3, 'Average', result['Charges'] / result['Claims'])
+
+        return result
+
+    def get_group_period_counts(self, column):
+        check_group_column(column)
+
+        result = self.cells.groupby([column, 'period'], as_index=False).agg(claims=('claims', 'sum'))
+
+        return result
+
+    def get_group_pivot(self, column):
+        result = self.get_group_period_counts(column)
+        result = result.pivot(index=column, columns='period', values='claims').fillna(0).astype('int64')
+
+        return result
+
+    def get_group_member_counts(self, column):
+        check_group_column(column)
+
+        result = self.cube.get_group_member_counts(self.mask, column)
+
+        return result
+
+    def get_icd_spec_counts(self, exclude_specialty_ids=()):
+        cells = self.cells[~self.cells['specialty_id'].isin(list(exclude_specialty_ids))]
+        result = cells.groupby(['icd_name', 'specialty_name'], as_index=False).agg(claims=('claims', 'sum'))
+
+        return result
+
+    def get_icd_spec_matrix(self, exclude_specialty_ids=(), n=10):
+        result = pivot_top_counts(self.get_icd_spec_counts(exclude_specialty_ids), n)
+
+        return result
+
+    def get_pareto_ranking(self, column):
+        check_group_column(column)
+
+        result = rank_pareto(self.cells, column, 'charges')
+
+        return result
+
@@ -0,0 +1,237 @@
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import functions.data_settings as ds
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# The dashboard's aggregates change with every ingested period; group_table's row count and
+# last rowid catch edits made to the claim rows alone
+DATA_VERSION_QUERIES = [('claim_data', "Select * from claim_data order by period"),
+                        ('period_member_count', "Select * from period_member_count order by period"),
+                        ('member_count_summary', "Select * from member_count_summary order by period"),
+                        ('group_period_summary', "Select * from group_period_summary "
+                                                 "order by group_column, name, period"),
+                        ('group_table', "Select Count(*), Max(rowid) from group_table")]
+
+
+def get_file_signature(db_path):
+    # Changes with every committed write: the header's change counter and page count (bytes
+    # 24-31), user_version (bytes 60-63), the size and mtime of the file and of a non-empty
+    # write-ahead log.  In WAL mode the change counter is not updated, so the mtimes carry it.
+    with open(db_path, 'rb') as db_file:
+        header = db_file.read(100)
+    stat = os.stat(db_path)
+    result = [header[24:32] + header[60:64], stat.st_size, stat.st_mtime_ns]
+
+    wal_path = db_path + '-wal'
+    if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+        stat = os.stat(wal_path)
+        result.extend([stat.st_size, stat.st_mtime_ns])
+
+    return tuple(result)
+
+
+@functools.lru_cache(maxsize=32)
+def get_content_version(db_path, file_signature):
+    # Hashes the tables' contents, so the same data has the same version on any copy of the file
+    # (a redeploy stays warm) and different data never shares one.  Only rerun when
+    # file_signature changes.
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in db_conn.execute("Select name from sqlite_master where type = 'table'")}
+        version = hashlib.sha1()
+        for table_name, db_query in DATA_VERSION_QUERIES:
+            if table_name in tables:
+                version.update(table_name.encode())
+                for row in db_conn.execute(db_query):
+                    version.update(repr(row).encode())
+    finally:
+        db_conn.close()
+
+    return version.hexdigest()[:16]
+
+
+def get_data_version(db_path):
+    # Reading the file signature costs a header read and two stats, so it is safe to call on
+    # every rerun; the contents are only hashed again after a write
+    result = get_content_version(os.path.abspath(db_path), get_file_signature(db_path))
+
+    return result
+
+
+@functools.lru_cache(maxsize=1)
+def get_code_version():
+    # Cached results are only reused by the same version of the code that built them
+    version = hashlib.sha1()
+    for file_name in sorted(os.listdir(FUNCTIONS_DIR)):
+        if file_name.endswith('.py'):
+            with open(os.path.join(FUNCTIONS_DIR, file_name), 'rb') as source_file:
+                version.update(source_file.read())
+
+    return version.hexdigest()[:16]
+
+
+class MemoryCacheBackend:
+    def __init__(self, ttl_seconds=None, max_entries=128):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl_seconds is not None and time.time() - created > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCacheBackend:
+    # A file that every Streamlit process on the host shares.  Entries expire after ttl_seconds
+    # and the least recently used ones are evicted once the stored bytes exceed max_bytes.
+    def __init__(self, path, ttl_seconds=None, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self.connect() as db_conn:
+            db_conn.execute("PRAGMA journal_mode = WAL")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS cache_entries "
+                            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)")
+            db_conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        db_conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db_conn:
+                yield db_conn
+        finally:
+            db_conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self.connect() as db_conn:
+            row = db_conn.execute("Select value, created from cache_entries where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                db_conn.execute("DELETE FROM cache_entries where key = ?", (key,))
+                return None
+            db_conn.execute("UPDATE cache_entries SET accessed = ? where key = ?", (now, key))
+
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if len(blob) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self.connect() as db_conn:
+            db_conn.execute("INSERT OR REPLACE INTO cache_entries (key, value, size, created, accessed) "
+                            "VALUES (?, ?, ?, ?, ?)", (key, blob, len(blob), now, now))
+            if self.ttl_seconds is not None:
+                db_conn.execute("DELETE FROM cache_entries where created < ?", (now - self.ttl_seconds,))
+            self.evict(db_conn)
+
+    def evict(self, db_conn):
+        total = db_conn.execute("Select Coalesce(Sum(size), 0) from cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = db_conn.execute("Select key, size from cache_entries order by accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            db_conn.execute("DELETE FROM cache_entries where key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self.connect() as db_conn:
+            db_conn.execute("DELETE FROM cache_entries")
+
+
+@functools.lru_cache(maxsize=1)
+def get_cache_backend():
+    if ds.CACHE_BACKEND == 'sqlite':
+        return SQLiteCacheBackend(ds.CACHE_PATH, ttl_seconds=ds.CACHE_TTL_SECONDS, max_bytes=ds.CACHE_MAX_BYTES)
+    if ds.CACHE_BACKEND == 'memory':
+        return MemoryCacheBackend(ttl_seconds=ds.CACHE_TTL_SECONDS)
+    if ds.CACHE_BACKEND is None:
+        return None
+
+    raise ValueError(f"Unknown cache backend: {ds.CACHE_BACKEND!r}")
+
+
+def get_source_version(func):
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__qualname__
+
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def make_cache_key(name, source_version, args, kwargs):
+    key = hashlib.sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+
+    return f'{name}:{get_code_version()}:{source_version}:{key}'
+
+
+def shared_cache(name):
+    # Arguments are part of the key, so cached builders take the data version (get_data_version)
+    # as an argument and results from older data are never returned.
+    def decorator(func):
+        source_version = get_source_version(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            backend = get_cache_backend()
+            if backend is None:
+                return func(*args, **kwargs)
+
+            key = make_cache_key(name, source_version, args, kwargs)
+            result = backend.get(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                backend.set(key, result)
+
+            return result
+
+        return wrapper
+
+    return decorator
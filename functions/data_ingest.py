@@ -0,0 +1,148 @@
+import argparse
+import sqlite3
+
+import pandas as pd
+
+import functions.data_settings as ds
+from functions.data_migrations import apply_migrations
+
+GROUP_TABLE_COLUMNS = ['period', 'mem_acct_id', 'injury_disease_id', 'icd_name', 'specialty_id', 'specialty_name',
+                       'charge_allowed']
+
+
+def get_period_claims(claims, period):
+    missing = [column for column in GROUP_TABLE_COLUMNS if column not in claims.columns and column != 'period']
+    if missing:
+        raise ValueError(f"Claims are missing columns: {missing}")
+
+    claims = claims.copy()
+    if 'period' not in claims.columns:
+        claims['period'] = period
+    if (claims['period'] != period).any():
+        raise ValueError(f"All claims must belong to period {period}")
+
+    return claims.loc[:, GROUP_TABLE_COLUMNS]
+
+
+def insert_rows(db_conn, table_name, frame):
+    # Plain executemany rather than DataFrame.to_sql, which commits and would end the
+    # surrounding transaction early.
+    columns = ', '.join(frame.columns)
+    placeholders = ', '.join('?' for _ in frame.columns)
+    rows = [tuple(value.item() if hasattr(value, 'item') else value for value in row)
+            for row in frame.itertuples(index=False)]
+    db_conn.executemany(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})", rows)
+
+
+def make_group_period_rows(claims, column):
+    result = claims.groupby([column, 'period'], as_index=False).agg(claims=('charge_allowed', 'count'),
+                                                                    charges=('charge_allowed', 'sum'),
+                                                                    max_charge=('charge_allowed', 'max')
+                                                                    )
+    result.insert(0, 'group_column', column)
+    result = result.rename(columns={column: 'name'})
+
+    return result
+
+
+def make_racing_rows(db_conn, claims, column, racing_table):
+    prior = pd.read_sql_query(f"Select name, Max(claim_count_ytd) as prior_ytd from {racing_table} group by name",
+                              db_conn)
+    result = claims.groupby(column, as_index=False, observed=True).agg(period_count=('charge_allowed', 'count'))
+    result = result.rename(columns={column: 'name'}).merge(prior, how='left', on='name')
+    result['claim_count_ytd'] = pd.to_numeric(result['prior_ytd']).fillna(0) + result['period_count']
+    result['period'] = claims['period'].iloc[0]
+
+    return result.loc[:, ['name', 'period', 'claim_count_ytd']]
+
+
+def make_claim_data_row(db_conn, claims, period, period_paid):
+    prior = db_conn.execute("Select claims_period_count_cum, claims_period_paid_cum from claim_data "
+                            "where period < ? order by period desc limit 1", (period,)).fetchone()
+    prior_count, prior_paid = prior if prior else (0, 0.0)
+    period_count = int(claims['charge_allowed'].count())
+    period_paid = round(float(period_paid), 0)
+
+    return (period, prior_count + period_count, prior_paid + period_paid, period_count, int(period_paid))
+
+
+def make_member_count_row(db_conn, period):
+    # Members whose first claim is in this period, found through idx_group_member, added to the
+    # previous period's year to date count
+    prior = db_conn.execute("Select members_ytd from member_count_summary "
+                            "where period < ? order by period desc limit 1", (period,)).fetchone()
+    new_members = db_conn.execute("Select Count(DISTINCT mem_acct_id) from group_table where period = ? and "
+                                  "mem_acct_id not in (Select mem_acct_id from group_table where period < ?)",
+                                  (period, period)).fetchone()[0]
+
+    return (period, (prior[0] if prior else 0) + new_members)
+
+
+def append_period(db_path, claims, period, period_paid=None, daily_member_sum=None):
+    # Adds one new period of claim rows and merges its aggregates into the stored running
+    # totals, so the cost depends on the size of the new period rather than the full history.
+    # claims has the group_table columns; period_paid is the period's paid total when it differs
+    # from the sum of charge_allowed, and daily_member_sum defaults to the period's distinct
+    # members with claims, as in the loaded periods.
+    claims = get_period_claims(claims, period)
+    if period_paid is None:
+        period_paid = claims['charge_allowed'].sum()
+    if daily_member_sum is None:
+        daily_member_sum = claims['mem_acct_id'].nunique()
+
+    apply_migrations(db_path)
+    db_conn = sqlite3.connect(db_path, isolation_level=None)
+
+    try:
+        db_conn.execute("BEGIN IMMEDIATE")
+        try:
+            latest = db_conn.execute("Select Max(period) from claim_data").fetchone()[0]
+            if latest is not None and period <= latest:
+                raise ValueError(f"Period {period} is already loaded (latest period is {latest})")
+
+            insert_rows(db_conn, 'group_table', claims)
+
+            claim_row = make_claim_data_row(db_conn, claims, period, period_paid)
+            db_conn.execute("INSERT INTO claim_data (period, claims_period_count_cum, claims_period_paid_cum, "
+                            "claims_period_count, claims_period_paid) VALUES (?, ?, ?, ?, ?)", claim_row)
+
+            db_conn.execute("INSERT INTO member_count_summary (period, members_ytd) VALUES (?, ?)",
+                            make_member_count_row(db_conn, period))
+
+            db_conn.execute("INSERT INTO period_member_count (period, daily_member_sum) VALUES (?, ?)",
+                            (period, int(daily_member_sum)))
+
+            icd_racing = make_racing_rows(db_conn, claims, 'icd_name', 'icd_racing')
+            insert_rows(db_conn, 'icd_racing', icd_racing)
+
+            racing_claims = claims[~claims['specialty_id'].isin(ds.RACING_EXCLUDED_SPECIALTY_IDS)]
+            if not racing_claims.empty:
+                specialty_racing = make_racing_rows(db_conn, racing_claims, 'specialty_name', 'specialty_racing')
+                insert_rows(db_conn, 'specialty_racing', specialty_racing)
+
+            for column in ['icd_name', 'specialty_name']:
+                summary_rows = make_group_period_rows(claims, column)
+                insert_rows(db_conn, 'group_period_summary', summary_rows)
+
+            db_conn.execute("COMMIT")
+        except Exception:
+            db_conn.execute("ROLLBACK")
+            raise
+    finally:
+        db_conn.close()
+
+    return claim_row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append one period of claims to the dashboard database.")
+    parser.add_argument('claims_csv', help="CSV file with the group_table columns for the new period")
+    parser.add_argument('--period', type=int, required=True)
+    parser.add_argument('--db', default='test_database.db')
+    parser.add_argument('--paid', type=float, default=None, help="Period paid total (default: sum of charges)")
+    parser.add_argument('--members', type=int, default=None, help="daily_member_sum for the period (default: distinct members with claims)")
+    args = parser.parse_args()
+
+    new_claims = pd.read_csv(args.claims_csv)
+    row = append_period(args.db, new_claims, args.period, period_paid=args.paid, daily_member_sum=args.members)
+    print(f"{args.db}: period {row[0]} appended, {row[3]:,} claims, {row[1]:,} claims year to date")
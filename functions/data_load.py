@@ -1,2 +1,427 @@
+import sqlite3
+import sys
 
+import numpy as np
+import pandas as pd
 
+from functions.data_metrics import timed
+
+GROUP_COLUMNS = ['icd_name', 'specialty_name']
+RACING_TABLES = ['icd_racing', 'specialty_racing']
+ID_COLUMNS = {'icd_name': 'injury_disease_id', 'specialty_name': 'specialty_id'}
+
+
+def as_group_query(source):
+    # Anything with the group methods (e.g. a ClaimCube selection) is used as it is
+    if isinstance(source, GroupTableQuery) or hasattr(source, 'get_group_pivot'):
+        return source
+
+    return GroupTableQuery(dataframe=source)
+
+
+def compact_claims_frame(dataframe):
+    # Text columns become categoricals (sorted categories, so groupbys run on the codes and
+    # still sort like strings), integers are downcast and floats move to float32 only when
+    # every value survives the round trip.
+    result = dataframe.copy()
+
+    for column in result.columns:
+        values = result[column]
+        if values.dtype == object:
+            result[column] = pd.Categorical(values, categories=sorted(values.dropna().unique()))
+        elif pd.api.types.is_integer_dtype(values):
+            result[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values) and values.dtype != 'float32':
+            compact_values = values.astype('float32')
+            if compact_values.astype(values.dtype).equals(values):
+                result[column] = compact_values
+
+    return result
+
+
+def read_only(*args, **kwargs):
+    raise TypeError("The shared claims frame is read-only; take .copy() to change it")
+
+
+class ReadOnlyIndexer:
+    # Wraps .loc/.iloc/.at/.iat of a ReadOnlyFrame: lookups pass through, assignments raise
+    def __init__(self, indexer):
+        self.indexer = indexer
+
+    def __call__(self, axis=None):
+        return ReadOnlyIndexer(self.indexer(axis))
+
+    def __getitem__(self, key):
+        return self.indexer[key]
+
+    def __getattr__(self, name):
+        return getattr(self.indexer, name)
+
+    __setitem__ = read_only
+
+
+class ReadOnlyFrame(pd.DataFrame):
+    # A claims frame shared by every session of the process.  Its arrays are read-only, its
+    # block manager cannot be swapped out, and item assignment (directly or through
+    # .loc/.iloc/.at/.iat), isetitem, insert, update, del and the inplace= methods raise.
+    # Selections, groupbys and copy() still return ordinary DataFrames.  Several of the blocked
+    # methods are pandas internals, checked against the pandas minor version pinned in
+    # requirements.txt; recheck them when that pin moves.
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def __setattr__(self, name, value):
+        # pandas applies most in-place changes by rebinding _mgr; only the first binding is allowed
+        if name == '_mgr' and '_mgr' in self.__dict__:
+            read_only()
+        super().__setattr__(name, value)
+
+    def _consolidate_inplace(self):
+        # Consolidating would copy the frozen blocks into fresh writable ones
+        pass
+
+    @property
+    def loc(self):
+        return ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return ReadOnlyIndexer(super().iat)
+
+    __setitem__ = read_only
+    __delitem__ = read_only
+    insert = read_only
+    isetitem = read_only
+    update = read_only
+    _set_item = read_only
+    _set_item_mgr = read_only
+    _iset_item = read_only
+    _iset_item_mgr = read_only
+    _set_axis = read_only
+    _update_inplace = read_only
+
+
+def freeze_frame(dataframe):
+    # Marks every column's buffer read-only without copying it: numpy columns become read-only
+    # views and categoricals are rebuilt on read-only views of their codes.
+    columns = {}
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[column] = pd.Categorical.from_codes(values.cat.codes.to_numpy(), dtype=values.dtype)
+        elif isinstance(values.dtype, np.dtype):
+            array = values.to_numpy().view()
+            array.flags.writeable = False
+            columns[column] = array
+        else:
+            columns[column] = values.array
+
+    result = ReadOnlyFrame(pd.DataFrame(columns, index=dataframe.index, copy=False))
+
+    return result
+
+
+def memory_report(before, after):
+    result = pd.DataFrame({'dtype_before': before.dtypes.astype(str),
+                           'dtype_after': after.dtypes.astype(str),
+                           'bytes_before': before.memory_usage(index=False, deep=True),
+                           'bytes_after': after.memory_usage(index=False, deep=True)
+                           })
+    result.loc['total'] = ['', '', result['bytes_before'].sum(), result['bytes_after'].sum()]
+    result['reduction'] = (1 - result['bytes_after'] / result['bytes_before']).round(3)
+
+    return result
+
+
+@timed()
+def get_racing_top(conn, table_name, n=10):
+    # Top n names per period ranked in the database with a window function
+    if table_name not in RACING_TABLES:
+        raise ValueError(f"Unsupported racing table: {table_name!r}")
+
+    db_query = (f"Select name, period, claim_count_ytd from "
+                f"(Select name, period, claim_count_ytd, "
+                f"Row_Number() Over (Partition By period Order By claim_count_ytd desc) as period_rank "
+                f"from {table_name}) as ranked "
+                f"where period_rank <= :n order by period, claim_count_ytd")
+    result = conn.query(db_query, params={'n': n})
+
+    return result
+
+
+@timed()
+def get_period_kpis(conn):
+    # Every header metric for every period in one query, indexed by period.  members_ytd comes
+    # from member_count_summary, so the database must be migrated (functions.data_migrations).
+    db_query = ("Select c.period, c.claims_period_count_cum, c.claims_period_paid_cum, c.claims_period_count, "
+                "c.claims_period_paid, p.daily_member_sum, m.members_ytd from claim_data c "
+                "left join period_member_count p on p.period = c.period "
+                "left join member_count_summary m on m.period = c.period order by c.period")
+    result = conn.query(db_query).set_index('period')
+
+    return result
+
+
+def pivot_top_counts(counts, n=10):
+    # counts has icd_name, specialty_name and claims.  Keeps the top n ICDs, then the top n
+    # specialties among them, as an icd_name x specialty_name matrix.
+    top_icd = counts.groupby('icd_name', as_index=False, observed=True)['claims'].sum().nlargest(n, 'claims')
+    counts = counts[counts['icd_name'].isin(top_icd['icd_name'])]
+    top_spec = counts.groupby('specialty_name', as_index=False, observed=True)['claims'].sum().nlargest(n, 'claims')
+    counts = counts[counts['specialty_name'].isin(top_spec['specialty_name'])]
+    result = counts.pivot_table(index='icd_name', columns='specialty_name', values='claims', aggfunc='sum',
+                                fill_value=0, observed=True)
+
+    return result
+
+
+def rank_pareto(table, column, value='charge_allowed'):
+    # Totals of value per column name, largest first, with each name's cumulative share of the
+    # grand total.  A cutoff selects a prefix of it (ParetoAnalysis.get_contributors, the hospital pies).
+    # Summed in float64 even when value is stored as float32 (the snapshot)
+    values = table[value].astype('float64')
+    result = (values.groupby(table[column], observed=True).sum().reset_index()
+              .sort_values(by=[value, column], ascending=[False, True], kind='stable')
+              .reset_index(drop=True)
+              )
+    cum_value = result[value].cumsum()
+    result['cum_share'] = cum_value / cum_value.iloc[-1] if len(result) else cum_value
+
+    return result
+
+
+def check_group_column(column):
+    if column not in GROUP_COLUMNS:
+        raise ValueError(f"Unsupported group column: {column!r}")
+
+
+class GroupTableQuery:
+    # Aggregates group_table in the database and only returns the small result sets the
+    # dashboard needs.  Without a connection the same results are computed with pandas.
+    # Summaries and period counts read the group_period_summary running totals, so the
+    # database must be migrated (functions.data_migrations) first.  The SQL is written so
+    # SQLite, DuckDB and PostgreSQL all accept it (quoted mixed-case aliases, BIGINT sums);
+    # the readers in functions.data_access adapt the :name parameters to their driver.
+    def __init__(self, conn=None, dataframe=None):
+        if conn is None and dataframe is None:
+            raise ValueError("GroupTableQuery needs a database connection or a dataframe")
+        self.conn = conn
+        self.table = dataframe
+
+    @timed()
+    def run_query(self, db_query, params=None):
+        result = self.conn.query(db_query, params=params)
+
+        return result
+
+    def get_group_summary(self, column):
+        check_group_column(column)
+
+        if self.conn is None:
+            # Aggregate in float64 even when charge_allowed is stored as float32
+            charges = self.table['charge_allowed'].astype('float64')
+            result = (charges.groupby(self.table[column], observed=True)
+                      .agg(Claims='count', Charges='sum', Average='mean', Max='max')
+                      .reset_index()
+                      )
+            return result
+
+        db_query = (f'Select name as {column}, Cast(Sum(claims) as BIGINT) as "Claims", Sum(charges) as "Charges", '
+                    f'Sum(charges) / Sum(claims) as "Average", Max(max_charge) as "Max" '
+                    f"from group_period_summary where group_column = :column group by name order by name")
+        result = self.run_query(db_query, params={'column': column})
+
+        return result
+
+    def get_group_period_counts(self, column):
+        check_group_column(column)
+
+        if self.conn is None:
+            result = (self.table.groupby([column, 'period'], as_index=False, observed=True)
+                      .agg(claims=('charge_allowed', 'count'))
+                      )
+            return result
+
+        db_query = (f"Select name as {column}, period, claims "
+                    f"from group_period_summary where group_column = :column order by name, period")
+        result = self.run_query(db_query, params={'column': column})
+
+        return result
+
+    def get_group_pivot(self, column):
+        check_group_column(column)
+
+        if self.conn is None:
+            result = self.table.pivot_table(index=column,
+                                            columns='period',
+                                            values='charge_allowed',
+                                            aggfunc='count',
+                                            fill_value=0,
+                                            observed=True
+                                            )
+            return result
+
+        result = self.get_group_period_counts(column)
+        result = result.pivot(index=column, columns='period', values='claims').fillna(0).astype('int64')
+
+        return result
+
+    def get_group_member_counts(self, column):
+        check_group_column(column)
+
+        if self.conn is None:
+            result = (self.table.groupby(column, as_index=False, observed=True)
+                      .agg(members=('mem_acct_id', 'nunique'))
+                      )
+            return result
+
+        db_query = (f"Select {column}, Count(DISTINCT mem_acct_id) as members "
+                    f"from group_table group by {column} order by {column}")
+        result = self.run_query(db_query)
+
+        return result
+
+    def get_icd_options(self):
+        if self.conn is None:
+            result = self.table['icd_name'].drop_duplicates().sort_values().astype(str)
+            return result
+
+        db_query = "Select DISTINCT icd_name from group_table order by icd_name"
+        result = self.run_query(db_query)['icd_name']
+
+        return result
+
+    def get_specialty_options(self):
+        if self.conn is None:
+            result = self.table['specialty_name'].drop_duplicates().sort_values().astype(str)
+            return result
+
+        db_query = "Select DISTINCT specialty_name from group_table order by specialty_name"
+        result = self.run_query(db_query)['specialty_name']
+
+        return result
+
+    def get_icd_spec_counts(self, exclude_specialty_ids=()):
+        exclude_specialty_ids = list(exclude_specialty_ids)
+
+        if self.conn is None:
+            result = self.table[~self.table['specialty_id'].isin(exclude_specialty_ids)]
+            result = (result.groupby(['icd_name', 'specialty_name'], as_index=False, observed=True)
+                      .agg(claims=('charge_allowed', 'count'))
+                      )
+            return result
+
+        params = {f'exclude_{i}': value for i, value in enumerate(exclude_specialty_ids)}
+        where = ''
+        if params:
+            where = f"where specialty_id not in ({', '.join(':' + key for key in params)}) "
+        db_query = (f"Select icd_name, specialty_name, Count(charge_allowed) as claims "
+                    f"from group_table {where}group by icd_name, specialty_name")
+        result = self.run_query(db_query, params=params or None)
+
+        return result
+
+    def get_cube_chunks(self, chunk_size):
+        # The claim rows data_app_calculations.ClaimCube rolls up, as integer ids, member and
+        # charge, chunk_size rows at a time from the database.  Nothing is aggregated or
+        # sorted in the database, and only one chunk is held at a time.
+        columns = ['period', 'injury_disease_id', 'specialty_id', 'mem_acct_id', 'charge_allowed']
+
+        if self.conn is None:
+            yield self.table.loc[:, columns]
+            return
+
+        db_query = f"Select {', '.join(columns)} from group_table"
+        if hasattr(self.conn, 'query_chunks'):
+            yield from self.conn.query_chunks(db_query, chunk_size=chunk_size)
+        else:
+            yield self.run_query(db_query)
+
+    def get_id_names(self, column, ids=None):
+        # The name of each id of the ICD or specialty column.  The database looks up one row per
+        # name through the name's index instead of grouping group_table by id, and only groups
+        # by id when that misses some of ids (a name used with more than one id).
+        check_group_column(column)
+        id_column = ID_COLUMNS[column]
+
+        if self.conn is None:
+            pairs = self.table.loc[:, [id_column, column]].drop_duplicates()
+            pairs[column] = pairs[column].astype(str)
+            result = pairs.groupby(id_column, as_index=False)[column].min()
+            return result
+
+        db_query = (f"Select (Select {id_column} from group_table g where g.{column} = n.{column} limit 1) "
+                    f"as {id_column}, {column} from (Select DISTINCT {column} from group_table) n")
+        result = self.run_query(db_query)
+        if ids is not None and not np.isin(ids, result[id_column]).all():
+            db_query = f"Select {id_column}, Min({column}) as {column} from group_table group by {id_column}"
+            result = self.run_query(db_query)
+        result = result.sort_values(column).drop_duplicates(id_column).reset_index(drop=True)
+
+        return result
+
+    def get_pareto_ranking(self, column):
+        # rank_pareto of charges per name; in the database one window query over the summary
+        check_group_column(column)
+
+        if self.conn is None:
+            result = rank_pareto(self.table, column).rename(columns={'charge_allowed': 'charges'})
+            return result
+
+        db_query = (f"Select name as {column}, charges, "
+                    f"Sum(charges) Over (Order By charges desc, name Rows Between Unbounded Preceding And Current Row) "
+                    f"/ Sum(charges) Over () as cum_share "
+                    f"from (Select name, Sum(charges) as charges from group_period_summary "
+                    f"where group_column = :column group by name) as totals order by charges desc, name")
+        result = self.run_query(db_query, params={'column': column})
+
+        return result
+
+    def get_icd_spec_matrix(self, exclude_specialty_ids=(), n=10):
+        # Claim counts of the top n ICDs by the top n specialties among them, as an
+        # icd_name x specialty_name matrix.  The database path ranks and filters in one query.
+        exclude_specialty_ids = list(exclude_specialty_ids)
+
+        if self.conn is None:
+            result = pivot_top_counts(self.get_icd_spec_counts(exclude_specialty_ids), n)
+            return result
+
+        params = {f'exclude_{i}': value for i, value in enumerate(exclude_specialty_ids)}
+        where = ''
+        if params:
+            where = f"where specialty_id not in ({', '.join(':' + key for key in params)}) "
+        params['n'] = n
+        # Ties are broken by name, the same order nlargest keeps on the name-sorted groups
+        db_query = (f"WITH counts AS MATERIALIZED (Select icd_name, specialty_name, "
+                    f"Count(charge_allowed) as claims from group_table {where}group by icd_name, specialty_name), "
+                    f"top_icd AS (Select icd_name from counts group by icd_name "
+                    f"order by Sum(claims) desc, icd_name limit :n), "
+                    f"top_spec AS (Select specialty_name from counts where icd_name in (Select icd_name from top_icd) "
+                    f"group by specialty_name order by Sum(claims) desc, specialty_name limit :n) "
+                    f"Select icd_name, specialty_name, claims from counts "
+                    f"where icd_name in (Select icd_name from top_icd) "
+                    f"and specialty_name in (Select specialty_name from top_spec)")
+        counts = self.run_query(db_query, params=params)
+        result = counts.pivot_table(index='icd_name', columns='specialty_name', values='claims', aggfunc='sum',
+                                    fill_value=0, observed=True)
+
+        return result
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'test_database.db'
+    db_conn = sqlite3.connect(path)
+    claims = pd.read_sql_query("Select * from group_table", db_conn)
+    db_conn.close()
+
+    with pd.option_context('display.width', 120, 'display.max_columns', None):
+        print(memory_report(claims, compact_claims_frame(claims)))
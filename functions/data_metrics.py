@@ -0,0 +1,202 @@
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import functions.data_settings as ds
+
+logger = logging.getLogger('dashboard.metrics')
+
+records = deque(maxlen=5000)
+summary = {}
+lock = threading.Lock()
+sequence = itertools.count()
+active = threading.local()
+
+
+def is_enabled():
+    return bool(ds.METRICS_ENABLED)
+
+
+def get_row_count(value):
+    if hasattr(value, 'shape'):
+        return int(value.shape[0])
+    if isinstance(value, (list, tuple, dict)):
+        return len(value)
+
+    return None
+
+
+def get_payload_bytes(value):
+    # What the value costs to hold or ship: text/bytes length, frame memory, figure JSON size
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(index=True, deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if hasattr(value, 'to_plotly_json'):
+        return len(value.to_json(validate=False))
+
+    return None
+
+
+def get_stack():
+    if not hasattr(active, 'stack'):
+        active.stack = []
+
+    return active.stack
+
+
+def add_record(record):
+    with lock:
+        records.append(record)
+        totals = summary.setdefault(record['name'], {'calls': 0, 'hits': 0, 'misses': 0, 'seconds': 0.0,
+                                                     'max_seconds': 0.0, 'rows': None, 'payload_bytes': None})
+        totals['calls'] += 1
+        totals['seconds'] += record['seconds']
+        totals['max_seconds'] = max(totals['max_seconds'], record['seconds'])
+        if record['cache'] == 'hit':
+            totals['hits'] += 1
+        elif record['cache'] == 'miss':
+            totals['misses'] += 1
+        for key in ['rows', 'payload_bytes']:
+            if record[key] is not None:
+                totals[key] = record[key]
+
+    if ds.METRICS_LOG_PATH:
+        logger.info(json.dumps(record))
+
+
+@contextlib.contextmanager
+def timer(name, cached=False):
+    # Times the block.  Set record['result'] to have its rows and payload size measured;
+    # with cached=True a cache_miss function running inside the block marks it as a miss.
+    if not is_enabled():
+        yield {}
+        return
+
+    record = {'seq': next(sequence), 'name': name, 'thread': threading.get_ident(), 'time': time.time(),
+              'cache': 'hit' if cached else None, 'result': None}
+    stack = get_stack()
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        stack.pop()
+        result = record.pop('result')
+        record['rows'] = get_row_count(result)
+        record['payload_bytes'] = get_payload_bytes(result)
+        add_record(record)
+
+
+def timed(name=None, cached=False):
+    # Decorator form of timer.  For cached fetches put timed(..., cached=True) outside the cache
+    # decorators and cache_miss inside them.
+    def decorator(func):
+        record_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+
+            with timer(record_name, cached) as record:
+                result = func(*args, **kwargs)
+                record['result'] = result
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def cache_miss(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = get_stack() if is_enabled() else []
+        if stack and stack[-1]['cache'] is not None:
+            stack[-1]['cache'] = 'miss'
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def get_sequence():
+    # Marks the start of a script run; get_records(start) then returns what that run recorded
+    result = next(sequence)
+
+    return result
+
+
+def get_records(start=0, thread=None):
+    thread = threading.get_ident() if thread is None else thread
+    with lock:
+        result = [dict(record) for record in records if record['seq'] >= start and record['thread'] == thread]
+
+    return result
+
+
+def get_summary():
+    with lock:
+        result = {name: dict(totals) for name, totals in summary.items()}
+
+    return result
+
+
+def clear():
+    with lock:
+        records.clear()
+        summary.clear()
+
+
+def format_prometheus(totals):
+    lines = ['# TYPE dashboard_calls_total counter',
+             '# TYPE dashboard_cache_hits_total counter',
+             '# TYPE dashboard_cache_misses_total counter',
+             '# TYPE dashboard_seconds_total counter',
+             '# TYPE dashboard_seconds_max gauge',
+             '# TYPE dashboard_rows gauge',
+             '# TYPE dashboard_payload_bytes gauge']
+    for name, values in sorted(totals.items()):
+        label = '{name="%s"}' % name.replace('\\', '\\\\').replace('"', '\\"')
+        lines.append(f"dashboard_calls_total{label} {values['calls']}")
+        lines.append(f"dashboard_cache_hits_total{label} {values['hits']}")
+        lines.append(f"dashboard_cache_misses_total{label} {values['misses']}")
+        lines.append(f"dashboard_seconds_total{label} {values['seconds']:.6f}")
+        lines.append(f"dashboard_seconds_max{label} {values['max_seconds']:.6f}")
+        if values['rows'] is not None:
+            lines.append(f"dashboard_rows{label} {values['rows']}")
+        if values['payload_bytes'] is not None:
+            lines.append(f"dashboard_payload_bytes{label} {values['payload_bytes']}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    # Written for a node_exporter textfile collector; replaced atomically so it is never read half written
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as metrics_file:
+        metrics_file.write(format_prometheus(get_summary()))
+    os.replace(path + '.tmp', path)
+
+
+def configure_log(path):
+    if path is None or any(getattr(handler, 'metrics_path', None) == path for handler in logger.handlers):
+        return
+
+    handler = logging.FileHandler(path)
+    handler.metrics_path = path
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
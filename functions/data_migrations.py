@@ -0,0 +1,188 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# Each migration is (version, statements).  The applied version is stored in the
+# database's PRAGMA user_version, so re-running apply_migrations is a no-op.
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_group_icd_period_charge "
+        "ON group_table (icd_name, period, charge_allowed)",
+        "CREATE INDEX IF NOT EXISTS idx_group_specialty_period_charge "
+        "ON group_table (specialty_name, period, charge_allowed)",
+        "CREATE INDEX IF NOT EXISTS idx_group_icd_specialty_charge "
+        "ON group_table (icd_name, specialty_name, specialty_id, charge_allowed)",
+        "CREATE INDEX IF NOT EXISTS idx_group_icd_member "
+        "ON group_table (icd_name, mem_acct_id)",
+        "CREATE INDEX IF NOT EXISTS idx_group_member "
+        "ON group_table (mem_acct_id)",
+        "CREATE INDEX IF NOT EXISTS idx_icd_racing_period "
+        "ON icd_racing (period, claim_count_ytd)",
+        "CREATE INDEX IF NOT EXISTS idx_specialty_racing_period "
+        "ON specialty_racing (period, claim_count_ytd)",
+        "CREATE INDEX IF NOT EXISTS idx_claim_data_period "
+        "ON claim_data (period)",
+        "CREATE INDEX IF NOT EXISTS idx_period_member_count_period "
+        "ON period_member_count (period)",
+    ]),
+    # Per-period running totals for each ICD and specialty, kept current by data_ingest
+    (2, [
+        "CREATE TABLE IF NOT EXISTS group_period_summary "
+        "(group_column TEXT, name TEXT, period INTEGER, claims INTEGER, charges REAL, max_charge REAL)",
+        "DELETE FROM group_period_summary",
+        "INSERT INTO group_period_summary "
+        "Select 'icd_name', icd_name, period, Count(charge_allowed), Sum(charge_allowed), Max(charge_allowed) "
+        "from group_table group by icd_name, period",
+        "INSERT INTO group_period_summary "
+        "Select 'specialty_name', specialty_name, period, Count(charge_allowed), Sum(charge_allowed), "
+        "Max(charge_allowed) from group_table group by specialty_name, period",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_group_period_summary "
+        "ON group_period_summary (group_column, name, period)",
+    ]),
+    # Distinct members with claims up to each period, so the KPI row never counts group_table
+    (3, [
+        "CREATE TABLE IF NOT EXISTS member_count_summary (period INTEGER PRIMARY KEY, members_ytd INTEGER)",
+        "DELETE FROM member_count_summary",
+        "INSERT INTO member_count_summary (period, members_ytd) "
+        "WITH first_periods AS MATERIALIZED "
+        "(Select Min(period) as first_period from group_table group by mem_acct_id) "
+        "Select c.period, (Select Count(*) from first_periods where first_period <= c.period) from claim_data c",
+    ]),
+]
+
+# Representative statements for the dashboard's access patterns, used by the plan report.
+HOT_QUERIES = [
+    ('icd summary',
+     "Select name, Sum(claims), Sum(charges), Max(max_charge) from group_period_summary "
+     "where group_column = 'icd_name' group by name order by name", {}),
+    ('specialty period counts',
+     "Select name, period, claims from group_period_summary "
+     "where group_column = 'specialty_name' order by name, period", {}),
+    ('icd member counts',
+     "Select icd_name, Count(DISTINCT mem_acct_id) from group_table group by icd_name", {}),
+    ('icd specialty counts',
+     "Select icd_name, specialty_name, Count(charge_allowed) from group_table group by icd_name, specialty_name",
+     {}),
+    ('period kpis',
+     "Select c.period, c.claims_period_count_cum, c.claims_period_paid_cum, c.claims_period_count, "
+     "c.claims_period_paid, p.daily_member_sum, m.members_ytd from claim_data c "
+     "left join period_member_count p on p.period = c.period "
+     "left join member_count_summary m on m.period = c.period order by c.period", {}),
+    ('heatmap matrix',
+     "WITH counts AS MATERIALIZED (Select icd_name, specialty_name, Count(charge_allowed) as claims "
+     "from group_table where specialty_id not in (209) group by icd_name, specialty_name), "
+     "top_icd AS (Select icd_name from counts group by icd_name order by Sum(claims) desc, icd_name limit 10), "
+     "top_spec AS (Select specialty_name from counts where icd_name in top_icd "
+     "group by specialty_name order by Sum(claims) desc, specialty_name limit 10) "
+     "Select icd_name, specialty_name, claims from counts where icd_name in top_icd and specialty_name in top_spec",
+     {}),
+    ('icd racing top 10',
+     "Select name, period, claim_count_ytd from (Select name, period, claim_count_ytd, "
+     "Row_Number() Over (Partition By period Order By claim_count_ytd desc) as period_rank from icd_racing) "
+     "where period_rank <= 10 order by period, claim_count_ytd", {}),
+]
+
+
+def get_schema_version(db_conn):
+    version = db_conn.execute("PRAGMA user_version").fetchone()[0]
+
+    return version
+
+
+def apply_migrations(db_path, migrations=None):
+    migrations = MIGRATIONS if migrations is None else migrations
+    db_conn = sqlite3.connect(db_path, isolation_level=None)
+
+    try:
+        # WAL lets the dashboard's read-only connections keep reading while ingest or a
+        # migration writes.  The mode is stored in the file, so this only runs once.
+        if db_conn.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+            db_conn.execute("PRAGMA journal_mode = WAL")
+
+        if get_schema_version(db_conn) >= migrations[-1][0]:
+            return get_schema_version(db_conn)
+
+        # BEGIN IMMEDIATE takes the write lock, so concurrent app processes starting at the
+        # same time apply each migration once and the rest see the new user_version.
+        db_conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = get_schema_version(db_conn)
+            for version, statements in migrations:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    db_conn.execute(statement)
+                db_conn.execute(f"PRAGMA user_version = {int(version)}")
+            db_conn.execute("COMMIT")
+        except Exception:
+            db_conn.execute("ROLLBACK")
+            raise
+
+        db_conn.execute("ANALYZE")
+
+        return get_schema_version(db_conn)
+    finally:
+        db_conn.close()
+
+
+def get_query_plans(db_path, queries=None):
+    queries = HOT_QUERIES if queries is None else queries
+    db_conn = sqlite3.connect(db_path)
+    plans = {}
+
+    try:
+        for name, db_query, params in queries:
+            rows = db_conn.execute(f"EXPLAIN QUERY PLAN {db_query}", params).fetchall()
+            plans[name] = [row[-1] for row in rows]
+    finally:
+        db_conn.close()
+
+    return plans
+
+
+def query_plan_report(db_path, queries=None):
+    # Works on a migrated temporary copy with every index dropped, so the report is the same
+    # whether or not db_path has already been migrated.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copy_path = os.path.join(temp_dir, os.path.basename(db_path))
+        shutil.copyfile(db_path, copy_path)
+
+        apply_migrations(copy_path)
+
+        db_conn = sqlite3.connect(copy_path)
+        index_names = db_conn.execute("Select name from sqlite_master "
+                                      "where type = 'index' and sql is not null").fetchall()
+        for (index_name,) in index_names:
+            db_conn.execute(f'DROP INDEX "{index_name}"')
+        db_conn.execute("DROP TABLE IF EXISTS sqlite_stat1")
+        db_conn.execute("PRAGMA user_version = 0")
+        db_conn.commit()
+        db_conn.close()
+
+        before = get_query_plans(copy_path, queries)
+        apply_migrations(copy_path)
+        after = get_query_plans(copy_path, queries)
+
+    report = []
+    for name in before:
+        report.append({'query': name, 'before': before[name], 'after': after[name]})
+
+    return report
+
+
+def format_query_plan_report(report):
+    lines = []
+    for entry in report:
+        lines.append(entry['query'])
+        lines.extend(f"    before: {step}" for step in entry['before'])
+        lines.extend(f"    after:  {step}" for step in entry['after'])
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'test_database.db'
+    print(format_query_plan_report(query_plan_report(path)))
+    print(f"{path}: schema version {apply_migrations(path)}")
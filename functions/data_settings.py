@@ -4,5 +4,32 @@ OVERHEAD_RATE = 0.11
 ADMIN_RATE = 0.1
 PROFIT_RATE = .07
 WRAP_RATE = round((((1 + OVERHEAD_RATE) * (1 + ADMIN_RATE)) * (1 + PROFIT_RATE) - 1), 2)
-PERIOD_LIST = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-CURRENT_PERIOD = 12
\ No newline at end of file
+PERIOD_LIST = None  # None shows the periods loaded in claim_data, e.g. [1, 2, ..., 12] to fix them
+CURRENT_PERIOD = None  # None takes the latest period loaded in claim_data
+BUDGET_DAY_COUNTS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]  # days budgeted in each period
+# What-if grids for the budget scenarios: daily budget 80-120% and each rate +/- 5 points
+SCENARIO_AVG_PER_DAY = [round(AVG_PER_DAY * (80 + 2 * i) / 100) for i in range(21)]
+SCENARIO_OVERHEAD_RATES = [round(OVERHEAD_RATE + (i - 5) / 100, 2) for i in range(11)]
+SCENARIO_ADMIN_RATES = [round(ADMIN_RATE + (i - 5) / 100, 2) for i in range(11)]
+SCENARIO_PROFIT_RATES = [round(PROFIT_RATE + (i - 5) / 100, 2) for i in range(11)]
+DB_BACKEND = 'sqlite'  # 'sqlite', 'duckdb' (DATABASE_PATH is a DuckDB file) or 'postgres' (DATABASE_URL)
+DATABASE_PATH = 'test_database.db'
+DATABASE_URL = None  # e.g. 'postgresql://dashboard@localhost/dashboard'
+DB_POOL_SIZE = 8  # read-only connections shared by all sessions of a process
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE_KIB = 64 * 1024  # page cache per connection
+RACING_EXCLUDED_SPECIALTY_IDS = [209]
+HEATMAP_EXCLUDED_SPECIALTY_IDS = [209]
+HEATMAP_TOP_N = 10
+PARETO_CUTOFF = 0.8  # share of charges the breakdown's contributing names make up
+CUBE_SKETCH_PRECISION = 14  # 2 ** 14 registers per distinct-member sketch, about 0.8% standard error
+CUBE_CHUNK_ROWS = 250_000  # claim rows read at a time while the cube is built
+SNAPSHOT_DIR = None  # e.g. 'snapshot' to load group_table from a memory-mapped Arrow snapshot
+CACHE_BACKEND = 'sqlite'  # 'sqlite' shares results between processes, 'memory' is per process, None disables
+CACHE_PATH = '.cache/dashboard_cache.db'
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+METRICS_ENABLED = False  # time fetches, builders and figures and show them in a sidebar panel
+METRICS_LOG_PATH = None  # e.g. 'metrics.jsonl' for one JSON line per timed call
+METRICS_PROMETHEUS_PATH = None  # e.g. 'metrics/dashboard.prom', rewritten after every run
+PERIOD_COMPARISON = 'browser'  # 'browser' switches periods in the page without a rerun, 'server' reruns the script
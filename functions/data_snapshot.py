@@ -0,0 +1,97 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from functions.data_cache import get_data_version
+from functions.data_load import compact_claims_frame, freeze_frame
+
+SNAPSHOT_TABLES = ['group_table', 'claim_data', 'period_member_count', 'icd_racing', 'specialty_racing']
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_source_fingerprint(db_path):
+    # The content hash the dashboard's caches are keyed on: it changes with every write to the
+    # data, not with the database or its WAL being opened, so a cold start reuses the snapshot
+    result = get_data_version(db_path)
+
+    return result
+
+
+def read_manifest(snapshot_dir):
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    return manifest
+
+
+def is_snapshot_current(db_path, snapshot_dir, tables=None):
+    tables = SNAPSHOT_TABLES if tables is None else tables
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest['fingerprint'] != get_source_fingerprint(db_path):
+        return False
+
+    return all(table_name in manifest['tables'] for table_name in tables)
+
+
+def to_arrow_table(dataframe):
+    # compact_claims_frame stores text as sorted dictionaries, so the columns load back as
+    # categoricals, and the narrow integer/float types are kept in the file.
+    return pa.Table.from_pandas(compact_claims_frame(dataframe), preserve_index=False)
+
+
+def export_snapshot(db_path, snapshot_dir, tables=None):
+    tables = SNAPSHOT_TABLES if tables is None else tables
+    os.makedirs(snapshot_dir, exist_ok=True)
+    fingerprint = get_source_fingerprint(db_path)
+
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for table_name in tables:
+            dataframe = pd.read_sql_query(f"Select * from {table_name}", db_conn)
+            table_path = os.path.join(snapshot_dir, f'{table_name}.arrow')
+            # Uncompressed so the file can be memory-mapped without decoding
+            feather.write_feather(to_arrow_table(dataframe), table_path + '.tmp', compression='uncompressed')
+            os.replace(table_path + '.tmp', table_path)
+    finally:
+        db_conn.close()
+
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump({'source': os.path.basename(db_path), 'fingerprint': fingerprint, 'tables': tables}, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return manifest_path
+
+
+def load_snapshot_table(snapshot_dir, table_name):
+    # The frames are shared by every session of the process (st.cache_resource), so they are
+    # frozen: numeric columns stay read-only views of the memory-mapped file.
+    table = feather.read_table(os.path.join(snapshot_dir, f'{table_name}.arrow'), memory_map=True)
+    result = freeze_frame(table.to_pandas(split_blocks=True))
+
+    return result
+
+
+def load_snapshot(db_path, snapshot_dir, tables=None):
+    tables = SNAPSHOT_TABLES if tables is None else tables
+    if not is_snapshot_current(db_path, snapshot_dir, tables):
+        export_snapshot(db_path, snapshot_dir, tables)
+
+    result = {table_name: load_snapshot_table(snapshot_dir, table_name) for table_name in tables}
+
+    return result
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'test_database.db'
+    directory = sys.argv[2] if len(sys.argv) > 2 else 'snapshot'
+    print(f"Snapshot written: {export_snapshot(path, directory)}")
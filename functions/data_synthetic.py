@@ -0,0 +1,214 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import functions.data_settings as ds
+from functions.data_ingest import insert_rows, make_claim_data_row, make_racing_rows
+from functions.data_migrations import apply_migrations
+
+ICD_NAMES = ['Abnormal_Discoveries', 'Blood_Organs', 'Circulatory', 'Congenital_Malform', 'Digestive',
+             'Endocrine_Hormone', 'Eye_Adnexa', 'Genitourinary', 'Infectious_Diseases', 'Injury_Poisoning',
+             'Mental_NeuroDisoders', 'Musculoskeletal', 'Neoplasms', 'Nervous_System', 'Other', 'Pregnancy',
+             'Respiratory', 'Skin_Tissue']
+SPECIALTY_NAMES = ['Allergy_Immun', 'Anesthesiology', 'Cardiology', 'Dental_Vision', 'Dermatology',
+                   'Gastroenterology', 'General_Medicine', 'General_Surgery', 'Hospital_Clinic', 'Medical_Supplies',
+                   'Nephrology', 'Neurology', 'Obstetrics', 'Occupational_Therapy', 'Oncology', 'Orthopedics',
+                   'Otolaryngology', 'Palliative_Care', 'Pathology', 'Psychiatry_Counseling', 'Pulmonology',
+                   'Radiology', 'Skilled_Medical_Labor', 'Urology', 'X-Ray']
+ICD_FIRST_ID = 101
+SPECIALTY_FIRST_ID = 201
+
+TABLE_SCHEMAS = {
+    'group_table': "(period INTEGER, mem_acct_id INTEGER, injury_disease_id INTEGER, icd_name TEXT, "
+                   "specialty_id INTEGER, specialty_name TEXT, charge_allowed REAL)",
+    'claim_data': "(period INTEGER, claims_period_count_cum INTEGER, claims_period_paid_cum REAL, "
+                  "claims_period_count INTEGER, claims_period_paid INTEGER)",
+    'period_member_count': "(period INTEGER, daily_member_sum INTEGER)",
+    'icd_racing': "(name TEXT, period INTEGER, claim_count_ytd REAL)",
+    'specialty_racing': "(name TEXT, period INTEGER, claim_count_ytd INTEGER)",
+}
+
+
+def make_names(names, count):
+    # The real names first, then numbered ones when more are requested
+    width = len(str(count))
+    result = names[:count] + [f'{names[-1]}_{i:0{width}d}' for i in range(len(names) + 1, count + 1)]
+
+    return result
+
+
+def make_skewed_weights(rng, count, skew=1.1):
+    # Zipf-like frequencies in a seeded random order, so a few names account for most claims
+    weights = 1 / np.arange(1, count + 1) ** skew
+    result = rng.permutation(weights / weights.sum())
+
+    return result
+
+
+def make_period_sizes(rng, n_claims, periods):
+    # Claim volume tapers off over the year, as in test_database.db
+    weights = np.linspace(1.0, 0.25, periods)
+    result = rng.multinomial(n_claims, weights / weights.sum())
+
+    return result
+
+
+class SyntheticClaims:
+    # Draws group_table rows period by period.  ICD and specialty frequencies and member
+    # activity are skewed, and charges are log-normal with a different level per ICD.
+    def __init__(self, icd_count=len(ICD_NAMES), specialty_count=len(SPECIALTY_NAMES), member_count=1000, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.member_count = member_count
+        self.icd_names = make_names(ICD_NAMES, icd_count)
+        self.specialty_names = make_names(SPECIALTY_NAMES, specialty_count)
+        self.icd_weights = make_skewed_weights(self.rng, icd_count)
+        self.specialty_weights = make_skewed_weights(self.rng, specialty_count)
+        self.member_weights = make_skewed_weights(self.rng, member_count, skew=0.6)
+        self.icd_charge_levels = self.rng.normal(4.9, 0.5, size=icd_count)
+
+    def make_period_claims(self, period, size):
+        icd_codes = self.rng.choice(len(self.icd_names), size=size, p=self.icd_weights).astype(np.int32)
+        specialty_codes = self.rng.choice(len(self.specialty_names), size=size,
+                                          p=self.specialty_weights).astype(np.int32)
+        members = self.rng.choice(self.member_count, size=size, p=self.member_weights).astype(np.int32) + 1
+        charges = np.maximum(np.round(self.rng.lognormal(self.icd_charge_levels[icd_codes], 1.3)), 1.0)
+
+        result = pd.DataFrame({
+            'period': np.full(size, period, dtype=np.int8),
+            'mem_acct_id': members,
+            'injury_disease_id': (icd_codes + ICD_FIRST_ID).astype(np.int32),
+            'icd_name': pd.Categorical.from_codes(icd_codes, categories=self.icd_names),
+            'specialty_id': (specialty_codes + SPECIALTY_FIRST_ID).astype(np.int32),
+            'specialty_name': pd.Categorical.from_codes(specialty_codes, categories=self.specialty_names),
+            'charge_allowed': charges,
+        })
+
+        return result
+
+    def iter_claims(self, n_claims, periods=12, chunk_size=1_000_000):
+        for period, size in enumerate(make_period_sizes(self.rng, n_claims, periods), start=1):
+            for start in range(0, size, chunk_size):
+                yield self.make_period_claims(period, min(chunk_size, size - start))
+
+
+def make_synthetic_claims(n_claims, icd_count=len(ICD_NAMES), specialty_count=len(SPECIALTY_NAMES), periods=12,
+                          member_count=None, seed=0):
+    # An in-memory group_table; the name columns are categoricals, like a frame loaded from a
+    # snapshot (compact_claims_frame), so tens of millions of rows fit in memory.
+    member_count = member_count or max(n_claims // 100, 1)
+    claims = SyntheticClaims(icd_count, specialty_count, member_count, seed)
+    result = pd.concat(list(claims.iter_claims(n_claims, periods)), ignore_index=True)
+
+    return result
+
+
+def insert_group_rows(db_conn, claims):
+    # Column lists zipped into tuples, which is much faster than iterating rows at this scale
+    columns = [claims[column].astype(object).tolist() if column.endswith('_name') else claims[column].tolist()
+               for column in claims.columns]
+    db_conn.executemany("INSERT INTO group_table VALUES (?, ?, ?, ?, ?, ?, ?)", zip(*columns))
+
+
+def add_period_summaries(db_conn, claims):
+    period = int(claims['period'].iloc[0])
+
+    claim_row = make_claim_data_row(db_conn, claims, period, claims['charge_allowed'].sum())
+    db_conn.execute("INSERT INTO claim_data VALUES (?, ?, ?, ?, ?)", claim_row)
+    db_conn.execute("INSERT INTO period_member_count VALUES (?, ?)", (period, int(claims['mem_acct_id'].nunique())))
+
+    insert_rows(db_conn, 'icd_racing', make_racing_rows(db_conn, claims, 'icd_name', 'icd_racing'))
+    racing_claims = claims[~claims['specialty_id'].isin(ds.RACING_EXCLUDED_SPECIALTY_IDS)]
+    if not racing_claims.empty:
+        insert_rows(db_conn, 'specialty_racing',
+                    make_racing_rows(db_conn, racing_claims, 'specialty_name', 'specialty_racing'))
+
+
+def generate_database(db_path, n_claims, icd_count=len(ICD_NAMES), specialty_count=len(SPECIALTY_NAMES), periods=12,
+                      member_count=None, seed=0, parquet_dir=None, chunk_size=1_000_000, overwrite=False):
+    # claim_data, period_member_count and the racing tables are derived from the generated
+    # rows with the same helpers data_ingest uses, and group_period_summary is backfilled by
+    # the migrations, so every table agrees with group_table.
+    if os.path.exists(db_path):
+        if not overwrite:
+            raise FileExistsError(f"{db_path} already exists")
+        os.remove(db_path)
+
+    member_count = member_count or max(n_claims // 100, 1)
+    claims_source = SyntheticClaims(icd_count, specialty_count, member_count, seed)
+    parquet_writer = None
+    if parquet_dir:
+        os.makedirs(parquet_dir, exist_ok=True)
+
+    db_conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # A new file, so there is nothing to protect while it is being filled
+        db_conn.execute("PRAGMA journal_mode = OFF")
+        db_conn.execute("PRAGMA synchronous = OFF")
+        db_conn.execute("BEGIN")
+        for table_name, schema in TABLE_SCHEMAS.items():
+            db_conn.execute(f"CREATE TABLE {table_name} {schema}")
+
+        period_claims = []
+        for claims in claims_source.iter_claims(n_claims, periods, chunk_size):
+            insert_group_rows(db_conn, claims)
+            if parquet_dir:
+                arrow_table = pa.Table.from_pandas(claims, preserve_index=False)
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(os.path.join(parquet_dir, 'group_table.parquet'),
+                                                      arrow_table.schema)
+                parquet_writer.write_table(arrow_table)
+
+            if period_claims and period_claims[0]['period'].iloc[0] != claims['period'].iloc[0]:
+                add_period_summaries(db_conn, pd.concat(period_claims, ignore_index=True))
+                period_claims = []
+            period_claims.append(claims.loc[:, ['period', 'mem_acct_id', 'icd_name', 'specialty_id',
+                                                'specialty_name', 'charge_allowed']])
+        if period_claims:
+            add_period_summaries(db_conn, pd.concat(period_claims, ignore_index=True))
+
+        db_conn.execute("COMMIT")
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+        db_conn.close()
+
+    apply_migrations(db_path)
+
+    if parquet_dir:
+        export_parquet(db_path, parquet_dir, [table_name for table_name in TABLE_SCHEMAS if table_name != 'group_table'])
+
+    return db_path
+
+
+def export_parquet(db_path, parquet_dir, tables):
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for table_name in tables:
+            dataframe = pd.read_sql_query(f"Select * from {table_name}", db_conn)
+            pq.write_table(pa.Table.from_pandas(dataframe, preserve_index=False),
+                           os.path.join(parquet_dir, f'{table_name}.parquet'))
+    finally:
+        db_conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic dashboard database at a chosen scale.")
+    parser.add_argument('db', help="Path of the new sqlite database")
+    parser.add_argument('--claims', type=int, default=1_000_000)
+    parser.add_argument('--icds', type=int, default=len(ICD_NAMES))
+    parser.add_argument('--specialties', type=int, default=len(SPECIALTY_NAMES))
+    parser.add_argument('--periods', type=int, default=12)
+    parser.add_argument('--members', type=int, default=None, help="Distinct members (default: claims / 100)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--parquet', default=None, help="Also write every table as Parquet into this directory")
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    generate_database(args.db, args.claims, args.icds, args.specialties, args.periods, args.members, args.seed,
+                      parquet_dir=args.parquet, overwrite=args.overwrite)
+    print(f"{args.db}: {args.claims:,} synthetic claims over {args.periods} periods")
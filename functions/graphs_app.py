@@ -1,23 +1,38 @@
+import copy
+import functools
+import json
+import math
+
+import numpy as np
+import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+
+from functions.data_app_calculations import ParetoAnalysis
+from functions.data_load import pivot_top_counts
+from functions.data_metrics import timed
 
 title_font = {'size': 25}
 font = {'size': 16}
 yaxis_currency = dict(tickprefix='$')
 yaxis_comma = dict(separatethousands=True)
+HOSPITAL_COLUMNS = {'ICD': 'icd_name', 'SPEC': 'specialty_name'}
+HOSPITAL_COLUMNS_INVERSE = {name: column for column, name in HOSPITAL_COLUMNS.items()}
 
 
+@timed()
 def make_bar_chart_period(table):
-    periods = [*range(1, 13)]
+    periods = table.index.to_numpy()
     fig = go.Figure(
         data=[
             go.Bar(name='Actual Charges', x=periods, y=table['claims_period_paid'], yaxis='y', offsetgroup=1),
             go.Bar(name='Budget Charges', x=periods, y=table['charge_budget'], yaxis='y', offsetgroup=2),
-            go.Line(name='Cumulative Variance', x=periods, y=table['cum_charge_variance'],
-                    yaxis='y2',
-                    marker=dict(size=10),
-                    line=dict(color='#DE2C62', width=4)
-                    ),
+            go.Scatter(name='Cumulative Variance', x=periods, y=table['cum_charge_variance'],
+                       yaxis='y2',
+                       marker=dict(size=10),
+                       line=dict(color='#DE2C62', width=4)
+                       ),
         ],
         layout={
             'yaxis2': {'title': "Cumulative Variance", 'overlaying': 'y', 'side': 'right'},
@@ -48,6 +63,7 @@ def make_bar_chart_period(table):
     return fig
 
 
+@timed()
 def make_profit_impact_bar(table):
     fig = go.Figure()
     fig.add_trace(
@@ -78,73 +94,153 @@ def make_profit_impact_bar(table):
     return fig
 
 
-def claims_indicator(c_claims, p_claims):
+INDICATOR_FORMATS = {'claims': ',', 'paid': ',', 'average': ',.2f', 'members': ','}
+
+
+@functools.lru_cache(maxsize=None)
+def get_indicator_template(valueformat):
+    # Built and validated once per format.  Treat the returned dict as read only.
     fig = go.Figure(go.Indicator(
         mode='delta',
-        value=c_claims,
-        delta={'reference': p_claims, 'relative': False, 'valueformat': ','}
+        value=0,
+        delta={'reference': 0, 'relative': False, 'valueformat': valueformat}
     ))
     fig.update_traces(delta_font={'size': 13})
     fig.update_layout(height=30, width=70)
-    if c_claims >= p_claims:
-        fig.update_traces(delta_increasing_color='green')
-    else:
-        fig.update_traces(delta_decreasing_color='red')
 
-    return fig
+    return fig.to_dict()
 
 
-def paid_indicator(c_paid, p_paid):
-    fig = go.Figure(go.Indicator(
-        mode='delta',
-        value=c_paid,
-        delta={'reference': p_paid, 'relative': False, 'valueformat': ','}
-    ))
-    fig.update_traces(delta_font={'size': 13})
-    fig.update_layout(height=30, width=70)
-    if c_paid >= p_paid:
-        fig.update_traces(delta_increasing_color='green')
+def make_indicator(value, reference, valueformat=','):
+    # Patches the values and delta color into a copy of the template trace; the template is
+    # already valid, so the figure is built without running plotly's validators again.
+    template = get_indicator_template(valueformat)
+    trace = copy.deepcopy(template['data'][0])
+    trace['value'] = value
+    trace['delta']['reference'] = reference
+    if value >= reference:
+        trace['delta']['increasing'] = {'color': 'green'}
     else:
-        fig.update_traces(delta_decreasing_color='red')
+        trace['delta']['decreasing'] = {'color': 'red'}
+
+    fig = go.Figure({'data': [trace], 'layout': template['layout']}, _validate=False)
 
     return fig
 
 
-def average_indicator(c_ave_per_claim, p_average):
-    fig = go.Figure(go.Indicator(
-        mode='delta',
-        value=c_ave_per_claim,
-        delta={'reference': p_average, 'relative': False, 'valueformat': ',.2f'}
-    ))
-    fig.update_traces(delta_font={'size': 13})
-    fig.update_layout(height=30, width=70)
-    if c_ave_per_claim >= p_average:
-        fig.update_traces(delta_increasing_color='green')
-    else:
-        fig.update_traces(delta_decreasing_color='red')
+@timed()
+def claims_indicator(c_claims, p_claims):
+    return make_indicator(c_claims, p_claims, INDICATOR_FORMATS['claims'])
+
+
+@timed()
+def paid_indicator(c_paid, p_paid):
+    return make_indicator(c_paid, p_paid, INDICATOR_FORMATS['paid'])
 
-    return fig
 
+@timed()
+def average_indicator(c_ave_per_claim, p_average):
+    return make_indicator(c_ave_per_claim, p_average, INDICATOR_FORMATS['average'])
 
+
+@timed()
 def member_indicator(c_member, p_member):
-    fig = go.Figure(go.Indicator(
-        mode='delta',
-        value=c_member,
-        delta={'reference': p_member, 'relative': False, 'valueformat': ','}
-    ))
-    fig.update_traces(delta_font={'size': 13})
-    fig.update_layout(height=30, width=70)
-    if c_member >= p_member:
-        fig.update_traces(delta_increasing_color='green')
-    else:
-        fig.update_traces(delta_decreasing_color='red')
+    return make_indicator(c_member, p_member, INDICATOR_FORMATS['members'])
+
+
+@timed()
+def make_period_indicators(table, current_period):
+    # The four indicators of the period comparison row for every period, from the
+    # period-indexed KPI frame (data_load.get_period_kpis)
+    values = pd.DataFrame({'claims': table['claims_period_count'],
+                           'paid': table['claims_period_paid'],
+                           'average': table['claims_period_paid'] / table['claims_period_count'],
+                           'members': table['daily_member_sum']
+                           })
+    values = values.to_dict('index')
+    current = values[current_period]
+
+    result = {}
+    for period, row in values.items():
+        result[period] = {key: make_indicator(current[key], row[key], valueformat)
+                          for key, valueformat in INDICATOR_FORMATS.items()}
+
+    return result
+
+
+# Browser-side version of the period comparison row: every period's values are embedded once
+# and the selected period's values and deltas are recomputed in the page, without a rerun.
+PERIOD_COMPARISON_HTML = """
+<style>
+  body {margin: 0; font-family: "Source Sans Pro", sans-serif; font-size: 16px; color: #C6CDD4;}
+  select {width: 12%; min-width: 90px; padding: 6px; margin-bottom: 14px; color: #C6CDD4;
+          background-color: #0083B8; border: none; border-radius: 6px; font-size: 15px;}
+  .grid {display: grid; grid-template-columns: repeat(5, 1fr); gap: 0 16px;}
+  .grid div {line-height: 1.9;}
+  .up {color: green;}
+  .down {color: red;}
+</style>
+<label for="period">Select Period:</label><br>
+<select id="period"></select>
+<div class="grid" id="grid"></div>
+<script>
+  const kpis = __KPIS__;
+  const current = __CURRENT_PERIOD__;
+  const metrics = [
+    {key: 'claims', prefix: '', digits: 0},
+    {key: 'paid', prefix: '$ ', digits: 0},
+    {key: 'average', prefix: '$ ', digits: 2},
+    {key: 'members', prefix: '', digits: 0},
+  ];
+  const format = (value, digits) => value === null ? '' : value.toLocaleString('en-US',
+      {minimumFractionDigits: digits, maximumFractionDigits: digits});
+  const select = document.getElementById('period');
+  Object.keys(kpis).forEach(period => select.add(new Option(period, period)));
+
+  function render() {
+    const period = select.value;
+    const cells = [['Current Period:', 'Select Period: ' + period, 'Difference']];
+    metrics.forEach(metric => {
+      const c = kpis[current][metric.key];
+      const p = kpis[period][metric.key];
+      const delta = c - p;
+      const arrow = delta >= 0 ? '<span class="up">&#9650;' : '<span class="down">&#9660;';
+      cells.push([metric.prefix + format(c, metric.digits), metric.prefix + format(p, metric.digits),
+                  arrow + format(Math.abs(delta), metric.digits) + '</span>']);
+    });
+    document.getElementById('grid').innerHTML = [0, 1, 2].map(row =>
+        cells.map(column => '<div>' + column[row] + '</div>').join('')).join('');
+  }
+
+  select.addEventListener('change', render);
+  render();
+</script>
+"""
+
+
+@timed()
+def make_period_comparison_html(table, current_period):
+    # table is the period-indexed KPI frame from data_load.get_period_kpis
+    kpis = {}
+    for period, row in table.iterrows():
+        kpis[int(period)] = {
+            'claims': int(row['claims_period_count']),
+            'paid': float(row['claims_period_paid']),
+            'average': float(row['claims_period_paid'] / row['claims_period_count']),
+            'members': None if math.isnan(row['daily_member_sum']) else int(row['daily_member_sum']),
+        }
 
-    return fig
+    result = (PERIOD_COMPARISON_HTML
+              .replace('__KPIS__', json.dumps(kpis))
+              .replace('__CURRENT_PERIOD__', json.dumps(int(current_period)))
+              )
 
+    return result
 
-def make_icd_spec_heatmap(table):
-    fig_table = get_icd_spec_pivot(table)
 
+@timed()
+def make_icd_spec_heatmap(fig_table):
+    # fig_table is the icd_name x specialty_name matrix (GroupTableQuery.get_icd_spec_matrix)
     fig = px.imshow(
         fig_table,
         aspect='auto',
@@ -174,65 +270,59 @@ def make_icd_spec_heatmap(table):
     return fig
 
 
-def get_icd_spec_pivot(table):
-    table = table.loc[:, ['icd_name', 'specialty_name', 'charge_allowed']]
-
-    group_icd = table.groupby('icd_name', as_index=False)['charge_allowed'].count().nlargest(10, 'charge_allowed')
-    icd_list = group_icd['icd_name'].to_list()
-    table = table[table['icd_name'].isin(icd_list)]
-    group_spec = table.groupby('specialty_name', as_index=False)['charge_allowed'].count().nlargest(10,
-                                                                                                    'charge_allowed')
-    spec_list = group_spec['specialty_name'].to_list()
-    table = table[table['specialty_name'].isin(spec_list)]
-    table = table.pivot_table(index='icd_name', columns='specialty_name', values='charge_allowed', aggfunc='count',
-                              fill_value=0)
-
-    return table
-
-
-def make_hospital_icd_pie(hospital_table):
-    hospital_table = hospital_table.groupby('ICD', as_index=False)['charge_allowed'].sum().sort_values(
-        by='charge_allowed', ascending=False)
-    hospital_table['cum_charges'] = hospital_table['charge_allowed'].cumsum()
-    hospital_table['% of total'] = hospital_table['cum_charges'] / (hospital_table.iloc[-1, 2])
-    hospital_table_cutoff = hospital_table[hospital_table['% of total'] < .8]
-
-    fig = px.pie(
-        hospital_table_cutoff,
-        names='ICD',
-        values='charge_allowed',
-    )
-
+@timed()
+def make_sensitivity_heatmap(table):
+    # table is BudgetScenarios.get_sensitivity_table('avg_per_day', 'overhead_rate'): total P&L
+    # impact by daily budget (rows) and overhead rate (columns)
+    fig = go.Figure(go.Heatmap(
+        z=table.to_numpy(),
+        x=[f'{value:.0%}' for value in table.columns],
+        y=[f'$ {value:,.0f}' for value in table.index],
+        colorscale='RdBu',
+        zmid=0,
+        xgap=1,
+        ygap=1,
+        hovertemplate="Daily Budget: %{y}"
+                      "<br>Overhead Rate: %{x}"
+                      "<br>P&L Impact: $ %{z:,.0f}<extra></extra>"
+    ))
     fig.update_layout(
         title=dict(
-            text='Top Injury or Diseases',
-            y=1.0,
+            text='P&L Sensitivity',
+            y=0.97,
             x=0.5,
             yanchor='top',
             xanchor='center'
         ),
         title_font=title_font,
+        xaxis_title='Overhead Rate',
+        yaxis_title='Daily Budget',
+        font=font,
     )
 
     return fig
 
 
-def make_hospital_spec_pie(hospital_table):
-    hospital_table = hospital_table.groupby('SPEC', as_index=False)['charge_allowed'].sum().sort_values(
-        by='charge_allowed', ascending=False)
-    hospital_table['cum_charges'] = hospital_table['charge_allowed'].cumsum()
-    hospital_table['% of total'] = hospital_table['cum_charges'] / (hospital_table.iloc[-1, 2])
-    hospital_table_cutoff = hospital_table[hospital_table['% of total'] < .8]
+@timed()
+def get_icd_spec_pivot(table):
+    table = table.loc[:, ['icd_name', 'specialty_name', 'claims']]
+    table = pivot_top_counts(table, n=10)
+
+    return table
+
 
+@timed()
+def make_pareto_pie(table, names, values, title):
+    # table is the contributing set of a Pareto ranking (ParetoAnalysis.get_contributors)
     fig = px.pie(
-        hospital_table_cutoff,
-        names='SPEC',
-        values='charge_allowed',
+        table,
+        names=names,
+        values=values,
     )
 
     fig.update_layout(
         title=dict(
-            text='Top Specialty',
+            text=title,
             y=1.0,
             x=0.5,
             yanchor='top',
@@ -244,46 +334,91 @@ def make_hospital_spec_pie(hospital_table):
     return fig
 
 
-def make_icd_racing_chart(table, table_title):
-    dict_keys = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve']
-    periods = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-    n_frame = {}
+def get_hospital_pareto(hospital_table):
+    # hospital_table has ICD, SPEC and charge_allowed columns; a ParetoAnalysis is used as it is,
+    # so both pies can share its per-dimension rankings
+    if isinstance(hospital_table, ParetoAnalysis):
+        return hospital_table
+
+    result = ParetoAnalysis(hospital_table.rename(columns=HOSPITAL_COLUMNS))
+
+    return result
+
+
+def get_hospital_contributors(hospital_table, column, cutoff):
+    contributors = get_hospital_pareto(hospital_table).get_contributors(column, cutoff, include_crossing=False)
+    result = contributors.rename(columns={column: HOSPITAL_COLUMNS_INVERSE[column], 'charges': 'charge_allowed'})
 
-    for p, d in zip(periods, dict_keys):
-        dataframe = table[(table['period'] == p)]
-        dataframe = dataframe.nlargest(n=10, columns=['claim_count_ytd'])
-        dataframe = dataframe.sort_values(by=['period', 'claim_count_ytd'])
+    return result
 
-        n_frame[d] = dataframe
+
+@timed()
+def make_hospital_icd_pie(hospital_table, cutoff=0.8):
+    fig = make_pareto_pie(get_hospital_contributors(hospital_table, 'icd_name', cutoff), 'ICD', 'charge_allowed',
+                          'Top Injury or Diseases')
+
+    return fig
+
+
+@timed()
+def make_hospital_spec_pie(hospital_table, cutoff=0.8):
+    fig = make_pareto_pie(get_hospital_contributors(hospital_table, 'specialty_name', cutoff), 'SPEC',
+                          'charge_allowed', 'Top Specialty')
+
+    return fig
+
+
+def get_racing_frames(table, n=10):
+    # Top n names per period in one sort + groupby, for any number of periods
+    table = table.sort_values(by=['period', 'claim_count_ytd'], ascending=[True, False], kind='stable')
+    table = table.groupby('period').head(n)
+    table = table.sort_values(by=['period', 'claim_count_ytd'], kind='stable')
+    n_frame = dict(tuple(table.groupby('period')))
+
+    return n_frame
+
+
+def get_racing_axis_max(table):
+    axis_max = math.ceil(table['claim_count_ytd'].max() * 1.01 / 100) * 100
+
+    return axis_max
+
+
+@timed()
+def make_icd_racing_chart(table, table_title, n=10):
+    n_frame = get_racing_frames(table, n)
+    first_period = min(n_frame)
+    first_frame = n_frame[first_period]
+    axis_max = get_racing_axis_max(table)
 
     fig = go.Figure(
         data=[
             go.Bar(
-                x=n_frame['one']['claim_count_ytd'],
-                y=n_frame['one']['name'],
+                x=first_frame['claim_count_ytd'],
+                y=first_frame['name'],
                 orientation='h',
-                text=n_frame['one']['claim_count_ytd'],
                 textfont=font,
-                texttemplate='%{text:,.0f}',
+                # Labels come from x, so frames (and the cached JSON) carry no duplicate text arrays
+                texttemplate='%{x:,.0f}',
                 textposition='inside',
                 insidetextanchor='middle',
                 width=0.8,
-                # marker={'color': n_frame['one']['color_code']}
+                # marker={'color': first_frame['color_code']}
             )
         ],
         layout=go.Layout(
-            xaxis=dict(range=[0, 8600],
+            xaxis=dict(range=[0, axis_max],
                        autorange=False,
                        separatethousands=True,
                        title=dict(text='Claims Processed',
                                   font=font
                                   )
                        ),
-            yaxis=dict(range=[-0.5, 9.5],
+            yaxis=dict(range=[-0.5, n - 0.5],
                        autorange=False,
                        tickfont=font
                        ),
-            title=dict(text=f'{table_title} Claims: Period 1',
+            title=dict(text=f'{table_title} Claims: Period {first_period}',
                        font=title_font,
                        x=0.5,
                        xanchor='center'
@@ -314,30 +449,154 @@ def make_icd_racing_chart(table, table_title):
                         x=value['claim_count_ytd'],
                         y=value['name'],
                         orientation='h',
-                        text=value['claim_count_ytd'],
                         # marker={'color': value['color_code']}
                     )
                 ],
                 layout=go.Layout(
-                    xaxis=dict(range=[0, 8600],
+                    xaxis=dict(range=[0, axis_max],
                                autorange=False
                                ),
-                    yaxis=dict(range=[-0.5, 9.5],
+                    yaxis=dict(range=[-0.5, n - 0.5],
                                autorange=False,
                                tickfont=font
                                ),
-                    title=dict(text=f'{table_title} Category: Period ' + str(value['period'].values[0]),
+                    title=dict(text=f'{table_title} Category: Period {period}',
                                font=title_font
                                )
                 )
             )
-            for key, value in n_frame.items()
+            for period, value in n_frame.items()
         ]
     )
 
     return fig
 
 
+def round_array(values, decimals):
+    # Floats rounded, and written as integers when they all are whole; anything that is not
+    # a plain numeric array (text, dates, gaps) is returned unchanged
+    array = np.asarray(values)
+    if array.dtype.kind == 'f':
+        array = np.round(array, decimals)
+        if np.isfinite(array).all() and (array == np.trunc(array)).all():
+            array = array.astype('int64')
+        return array
+    if array.dtype.kind in 'iu':
+        return array
+
+    return values
+
+
+def round_trace_arrays(trace, decimals):
+    result = {}
+    for key, value in trace.items():
+        if isinstance(value, dict):
+            result[key] = round_trace_arrays(value, decimals)
+        elif isinstance(value, (list, tuple, np.ndarray)) and len(value) and not isinstance(value[0], dict):
+            result[key] = round_array(value, decimals)
+        else:
+            result[key] = value
+
+    return result
+
+
+def get_json_key(value):
+    return json.dumps(value, default=lambda item: np.asarray(item).tolist(), sort_keys=True)
+
+
+def get_shared(specs):
+    # The settings every spec has with the same value, e.g. the axes all frames of a chart repeat
+    result = {}
+    for key, value in specs[0].items():
+        values = [spec.get(key) for spec in specs]
+        if all(isinstance(item, dict) for item in values):
+            shared = get_shared(values)
+            if shared:
+                result[key] = shared
+        elif all(key in spec for spec in specs) and len({get_json_key(item) for item in values}) == 1:
+            result[key] = value
+
+    return result
+
+
+def drop_shared(spec, shared, keep=()):
+    result = {}
+    for key, value in spec.items():
+        if key in keep or key not in shared:
+            result[key] = value
+        elif isinstance(value, dict):
+            remaining = drop_shared(value, shared[key])
+            if remaining:
+                result[key] = remaining
+
+    return result
+
+
+@timed()
+def compact_figure(fig, decimals=2):
+    # The same chart in fewer bytes: numeric trace arrays rounded, animation frames cut down to
+    # what changes between them and the template's trace defaults kept for the trace types used
+    spec = fig.to_dict()
+    spec['data'] = [round_trace_arrays(trace, decimals) for trace in spec['data']]
+
+    # A frame keeps what changes between frames; what the figure and every frame share is
+    # already in the figure.  Frame traces keep their type, which would otherwise default to scatter.
+    frames = [dict(frame) for frame in spec.get('frames', [])]
+    if frames:
+        shared_layout = get_shared([spec['layout'], *[frame.get('layout', {}) for frame in frames]])
+        for frame in frames:
+            frame_layout = drop_shared(frame.pop('layout', {}), shared_layout)
+            if frame_layout:
+                frame['layout'] = frame_layout
+        same_traces = all('traces' not in frame and len(frame.get('data', [])) == len(spec['data'])
+                          for frame in frames)
+        for index, trace in enumerate(spec['data'] if same_traces else []):
+            frame_traces = [round_trace_arrays(frame['data'][index], decimals) for frame in frames]
+            shared_trace = get_shared([trace, *frame_traces])
+            for frame, frame_trace in zip(frames, frame_traces):
+                frame['data'][index] = drop_shared(frame_trace, shared_trace, keep=('type',))
+        spec['frames'] = frames
+
+    template = spec['layout'].get('template')
+    if template and 'data' in template:
+        trace_types = {trace.get('type', 'scatter') for trace in spec['data']}
+        trace_types.update(trace.get('type', 'scatter') for frame in frames for trace in frame['data'])
+        template['data'] = {trace_type: value for trace_type, value in template['data'].items()
+                            if trace_type in trace_types}
+
+    result = go.Figure(spec, _validate=False)
+
+    return result
+
+
+def get_figure_json(fig):
+    # What st.plotly_chart sends for the figure.  Plotly's 'auto' JSON engine encodes with
+    # orjson when it is installed, which is several times faster than the json module.
+    result = pio.to_json(fig, validate=False)
+
+    return result
+
+
+def payload_report(figures):
+    # Bytes of each named figure as sent to the browser, before and after compact_figure
+    result = []
+    for name, fig in figures.items():
+        before = len(get_figure_json(fig))
+        after = len(get_figure_json(compact_figure(fig)))
+        result.append({'chart': name, 'bytes_before': before, 'bytes_after': after,
+                       'reduction': round(1 - after / before, 3)})
+
+    return pd.DataFrame(result)
+
+
+@timed()
+def load_figure_json(figure_json):
+    fig = pio.from_json(figure_json)
+
+    return fig
+
+
+@timed()
 def make_icd_period_bar_chart(table, choice):
     fig = go.Figure(
         data=[
@@ -359,6 +618,7 @@ def make_icd_period_bar_chart(table, choice):
     return fig
 
 
+@timed()
 def make_icd_specialty_bar_chart(table, choice):
     fig = go.Figure(
         data=[
@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import streamlit
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+PERCENTILES = [50, 90, 95, 99]
+
+
+def get_rss_bytes():
+    # Resident memory of this process; the peak where /proc is not available
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def get_widget(elements, label=None, key=None):
+    for element in elements:
+        if (key is not None and element.key == key) or (label is not None and element.label.startswith(label)):
+            return element
+
+    return None
+
+
+def open_sections(app, rng):
+    toggles = [toggle for toggle in app.toggle if toggle.key != 'show_metrics']
+    for toggle in rng.sample(toggles, rng.randint(1, len(toggles))):
+        toggle.set_value(True)
+
+    return bool(toggles)
+
+
+def flip_section(app, rng):
+    toggles = [toggle for toggle in app.toggle if toggle.key != 'show_metrics']
+    if not toggles:
+        return False
+
+    toggle = rng.choice(toggles)
+    toggle.set_value(not toggle.value)
+
+    return True
+
+
+def select_period(app, rng):
+    # Only there with PERIOD_COMPARISON = 'server'; the browser version never reruns the app
+    selectbox = get_widget(app.selectbox, label="Select Period")
+    if selectbox is None:
+        return False
+
+    selectbox.set_value(rng.choice([int(option) for option in selectbox.options]))
+
+    return True
+
+
+def select_icd(app, rng):
+    selectbox = get_widget(app.selectbox, label="Select an Injury or Disease")
+    if selectbox is None:
+        return False
+
+    selectbox.set_value(rng.choice(selectbox.options))
+
+    return True
+
+
+def filter_periods(app, rng):
+    select_slider = get_widget(app.select_slider, key='filter_periods')
+    if select_slider is None:
+        return False
+
+    first, last = sorted(rng.sample([int(option) for option in select_slider.options], 2))
+    select_slider.set_value((first, last))
+
+    return True
+
+
+def filter_names(app, rng):
+    multiselect = get_widget(app.multiselect, key=rng.choice(['filter_icd_names', 'filter_specialty_names']))
+    if multiselect is None:
+        return False
+
+    for option in list(multiselect.value):
+        multiselect.unselect(option)
+    for option in rng.sample(multiselect.options, rng.randint(0, 2)):
+        multiselect.select(option)
+
+    return True
+
+
+def move_slider(app, rng):
+    # The budget scenario and breakdown sliders
+    sliders = list(app.slider)
+    if not sliders:
+        return False
+
+    slider = rng.choice(sliders)
+    steps = int(round((slider.max - slider.min) / slider.step))
+    value = slider.min + rng.randint(0, steps) * slider.step
+    slider.set_value(round(value, 6) if isinstance(slider.step, float) else value)
+
+    return True
+
+
+INTERACTIONS = {
+    'open_sections': open_sections,
+    'flip_section': flip_section,
+    'select_period': select_period,
+    'select_icd': select_icd,
+    'filter_periods': filter_periods,
+    'filter_names': filter_names,
+    'move_slider': move_slider,
+}
+
+
+def run_app(app, timings, name):
+    start = time.perf_counter()
+    app.run()
+    timings.append({'interaction': name, 'seconds': time.perf_counter() - start, 'errors': len(app.exception)})
+
+
+def run_load_test(sessions=8, interactions=20, seed=0, app_path=APP_PATH, timeout=300, progress=None):
+    # AppTest runs one script at a time per process, so the sessions take turns: every session
+    # keeps its own widget state and all of them share the process's caches, as in a server.
+    from streamlit.testing.v1 import AppTest
+
+    if sessions < 1 or interactions < 1:
+        raise ValueError(f"The load test needs at least 1 session and 1 interaction, got {sessions} and {interactions}")
+
+    timings = []
+    rss_start = get_rss_bytes()
+    apps = []
+    rngs = []
+
+    for index in range(sessions):
+        app = AppTest.from_file(app_path, default_timeout=timeout)
+        run_app(app, timings, 'cold_start' if index == 0 else 'session_start')
+        apps.append(app)
+        rngs.append(random.Random(seed * 1000 + index))
+        if index == 0:
+            rss_warm = get_rss_bytes()
+
+    start = time.perf_counter()
+    for step in range(interactions):
+        for app, rng in zip(apps, rngs):
+            name = rng.choice(list(INTERACTIONS))
+            if not INTERACTIONS[name](app, rng):
+                name = 'open_sections'
+                open_sections(app, rng)
+            run_app(app, timings, name)
+        if progress:
+            progress(step + 1)
+    elapsed = time.perf_counter() - start
+    rss_end = get_rss_bytes()
+
+    result = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'streamlit': streamlit.__version__,
+              'sessions': sessions,
+              'interactions': interactions,
+              'seed': seed,
+              'reruns': sessions * interactions,
+              'seconds': round(elapsed, 4),
+              'reruns_per_second': round(sessions * interactions / elapsed, 3) if elapsed else None,
+              'errors': sum(timing['errors'] for timing in timings),
+              'rss_start_bytes': rss_start,
+              'rss_warm_bytes': rss_warm,
+              'rss_end_bytes': rss_end,
+              'rss_growth_per_session_bytes': int((rss_end - rss_warm) / sessions),
+              'latency': summarize_timings([timing for timing in timings
+                                            if timing['interaction'] not in ('cold_start', 'session_start')]),
+              'interaction_latency': {},
+              }
+    for name in sorted({timing['interaction'] for timing in timings}):
+        result['interaction_latency'][name] = summarize_timings([timing for timing in timings
+                                                                 if timing['interaction'] == name])
+
+    return result
+
+
+def summarize_timings(timings):
+    seconds = np.array([timing['seconds'] for timing in timings])
+    if not len(seconds):
+        return None
+
+    result = {'count': len(seconds), 'mean_seconds': round(float(seconds.mean()), 6),
+              'max_seconds': round(float(seconds.max()), 6)}
+    for percentile, value in zip(PERCENTILES, np.percentile(seconds, PERCENTILES)):
+        result[f'p{percentile}_seconds'] = round(float(value), 6)
+
+    return result
+
+
+def compare_results(baseline, current, threshold=0.2):
+    # Rerun latency percentiles that grew by more than threshold (a fraction) against the baseline
+    regressions = []
+    for key in [f'p{percentile}_seconds' for percentile in PERCENTILES]:
+        before = baseline['latency'][key]
+        after = current['latency'][key]
+        if before > 0 and (after - before) / before > threshold:
+            regressions.append({'metric': key, 'before': before, 'after': after,
+                                'change': round((after - before) / before, 3)})
+
+    return regressions
+
+
+def format_report(result):
+    lines = [f"{result['sessions']} sessions x {result['interactions']} interactions: {result['reruns']} reruns "
+             f"in {result['seconds']:,.1f} s ({result['reruns_per_second']:,.1f} reruns/s), "
+             f"{result['errors']} errors",
+             f"    memory: {result['rss_start_bytes'] / 2 ** 20:,.1f} MiB at start, "
+             f"{result['rss_warm_bytes'] / 2 ** 20:,.1f} MiB after the first session, "
+             f"{result['rss_end_bytes'] / 2 ** 20:,.1f} MiB at the end "
+             f"({result['rss_growth_per_session_bytes'] / 2 ** 20:,.2f} MiB per session)",
+             f"    {'interaction':<16} {'count':>6} " + ' '.join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+             + f" {'max ms':>9}"]
+    for name, summary in [('all reruns', result['latency']), *result['interaction_latency'].items()]:
+        lines.append(f"    {name:<16} {summary['count']:>6} "
+                     + ' '.join(f"{summary[f'p{p}_seconds'] * 1000:>9,.1f}" for p in PERCENTILES)
+                     + f" {summary['max_seconds'] * 1000:>9,.1f}")
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drive simulated dashboard sessions through app.py without a "
+                                                 "browser and report rerun latency, throughput and memory.")
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--interactions', type=int, default=20, help="Widget changes per session")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--compare', default=None, help="Earlier results file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown before reporting (0.2 = 20%%)")
+    args = parser.parse_args()
+    if args.sessions < 1 or args.interactions < 1:
+        parser.error("--sessions and --interactions must be at least 1")
+
+    results = run_load_test(args.sessions, args.interactions, args.seed, args.app)
+    print(format_report(results))
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            found = compare_results(json.load(baseline_file), results, args.threshold)
+        for regression in found:
+            print(f"Regression {regression['metric']}: {regression['before']:.4f}s -> {regression['after']:.4f}s "
+                  f"({regression['change']:+.0%})")
+        if found:
+            raise SystemExit(1)